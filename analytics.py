@@ -0,0 +1,50 @@
+"""Organisation-wide attendance rates for the Analytics dashboard.
+
+MongoDB reduces every saved session to its mark and present counts; the
+breakdowns by trainer, training, weekday and month are then grouped sums
+over that one small frame, so no Python loop runs per session.
+"""
+import pandas as pd
+
+import repository
+
+WEEKDAY_ORDER = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday",
+                 "Saturday", "Sunday"]
+
+
+def session_frame(start_date=None, end_date=None):
+    """One row per saved session with its training, trainer, weekday and month."""
+    sessions = pd.DataFrame(
+        repository.session_totals(start_date, end_date),
+        columns=["training_id", "date", "marks", "present"]
+    )
+    labels = pd.DataFrame.from_dict(
+        repository.training_labels(), orient="index", columns=["training", "trainer"])
+    dates = pd.to_datetime(sessions["date"], format="%Y-%m-%d")
+    return sessions.join(labels, on="training_id").assign(
+        weekday=pd.Categorical(dates.dt.day_name(), categories=WEEKDAY_ORDER),
+        month=dates.dt.strftime("%Y-%m"),
+    )
+
+
+def attendance_rates(sessions, by):
+    """Sessions, marks, presents and attendance % per value of the by column(s)."""
+    totals = sessions.groupby(by, observed=True)[["marks", "present"]].sum()
+    totals.insert(0, "sessions", sessions.groupby(by, observed=True).size())
+    marks = totals["marks"].where(totals["marks"] > 0)
+    totals["Attendance %"] = (totals["present"] / marks * 100).round(1).fillna(0)
+    return totals.rename(columns={
+        "sessions": "Sessions", "marks": "Marks", "present": "Present",
+    }).reset_index()
+
+
+def overview(sessions):
+    """Headline numbers across every session in the frame."""
+    marks = int(sessions["marks"].sum())
+    present = int(sessions["present"].sum())
+    return {
+        "sessions": len(sessions),
+        "trainings": sessions["training_id"].nunique(),
+        "marks": marks,
+        "rate": round(present / marks * 100, 1) if marks else 0.0,
+    }
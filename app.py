@@ -1,22 +1,50 @@
-import streamlit as st
-from pymongo import MongoClient
-from datetime import datetime
-import pandas as pd
 import os
 
-# Read MongoDB URL from environment variable
-MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017/")
+import altair as alt
+import streamlit as st
+from datetime import datetime, timedelta
+import pandas as pd
 
-# MongoDB Connection
-client = MongoClient(MONGODB_URL)
-db = client["training_db"]
-users_collection = db["users"]
-trainings_collection = db["trainings"]
-participants_collection = db["participants"]
-attendance_collection = db["attendance"]
+import analytics
+import attendance
+import exporter
+import importer
+import jobs
+import migrations
+import monitoring
+import repository
+import schedule
 
 st.set_page_config(page_title="Training Management System", layout="wide")
 
+# Build indexes and apply pending migrations once per server process. Pages
+# would mix old and new document shapes on a half-migrated database, so the
+# app stops until the migration succeeds.
+try:
+    migrations.bootstrap()
+except Exception as e:
+    st.error(f"The database could not be migrated: {e}. "
+             "Fix the cause, then run `python manage.py migrate`.")
+    st.stop()
+
+# Attendance matrices larger than this are shown without cell highlighting
+STYLED_MATRIX_MAX_CELLS = 20000
+
+# Most session dates the attendance grid shows at once
+MAX_GRID_DATES = 31
+
+# Rows per page in the View and Past Removals tables
+PAGE_SIZE = 50
+
+# Matches shown under a participant search box
+SEARCH_LIMIT = 20
+
+# How often a running background job's progress is re-read
+JOB_POLL_SECONDS = 2
+
+# Usernames that see the Performance panel in the sidebar
+ADMIN_USERS = {u.strip() for u in os.getenv("ADMIN_USERS", "admin").split(",") if u.strip()}
+
 # Initialize session state for authentication
 if "authenticated" not in st.session_state:
     st.session_state.authenticated = False
@@ -25,9 +53,7 @@ if "authenticated" not in st.session_state:
 
 
 def authenticate(username, password):
-    user = users_collection.find_one(
-        {"username": username, "password": password})
-    return user is not None
+    return repository.authenticate(username, password)
 
 # --- LOGIN PAGE ---
 
@@ -46,6 +72,174 @@ def login_page():
             st.error("Invalid username or password")
 
 
+# --- PAGINATED TABLES ---
+
+
+def paged_table(slot, signature, load_page, columns, page_size=PAGE_SIZE):
+    """Show one page from load_page(after, limit) with Previous/Next buttons.
+
+    The start key of every page visited is kept in session state under slot,
+    and the stack is reset whenever signature (filters, sort) changes.
+    columns maps document fields to the headers shown.
+    """
+    state = st.session_state.get(slot)
+    if state is None or state["signature"] != signature:
+        state = {"signature": signature, "starts": [None], "next": None}
+        st.session_state[slot] = state
+
+    rows, state["next"] = load_page(state["starts"][-1], page_size)
+
+    if rows:
+        table = pd.DataFrame(rows).reindex(columns=list(columns))
+        st.dataframe(table.rename(columns=columns),
+                     use_container_width=True, hide_index=True)
+    else:
+        st.write("No records found.")
+
+    def previous_page():
+        if len(state["starts"]) > 1:
+            state["starts"].pop()
+
+    def next_page():
+        if state["next"] is not None:
+            state["starts"].append(state["next"])
+
+    col1, col2, col3 = st.columns([1, 1, 6])
+    col1.button("Previous", key=f"{slot}_previous", on_click=previous_page,
+                disabled=len(state["starts"]) == 1)
+    col2.button("Next", key=f"{slot}_next", on_click=next_page,
+                disabled=state["next"] is None)
+    col3.write(f"Page {len(state['starts'])}")
+
+
+# --- BACKGROUND JOBS ---
+
+
+def show_job_result(job):
+    """Outcome of a finished job, including its download for exports."""
+    result = job.get("result") or {}
+    if job["status"] != "succeeded":
+        st.error(f"{job['label']} {job['status']}: {job.get('error')}")
+    elif job["kind"] == "import_participants":
+        st.success(f"{result['inserted']} participants added, "
+                   f"{result['updated']} updated.")
+        if result["errors"]:
+            st.warning(f"{result['error_count']} rows had problems:")
+            st.dataframe(pd.DataFrame(result["errors"]),
+                         use_container_width=True, hide_index=True)
+    elif job["kind"] == "import_attendance":
+        st.success(f"Saved {result['sessions']} sessions from the sheet.")
+    elif job["kind"] == "export_attendance":
+        st.success(f"Exported {result['sessions']} sessions.")
+        st.download_button(
+            f"Download {result['file_name']}", jobs.job_file(job),
+            file_name=result["file_name"], mime=result["mime"],
+            key=f"download_{job['_id']}")
+    elif job["kind"] == "rebuild_rollups":
+        st.success(f"Rebuilt rollups for {result['trainings']} trainings.")
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def poll_job(job_id):
+    """Progress of a queued or running job, re-read without rerunning the page."""
+    with monitoring.measure("Job progress"):
+        job = jobs.get(job_id)
+    if job["status"] not in jobs.ACTIVE_STATUSES:
+        st.rerun()
+    if job["status"] == "queued":
+        st.info(f"{job['label']}: waiting for a free worker...")
+        return
+    done, total = job["progress"]["done"], job["progress"]["total"]
+    fraction = min(done / total, 1.0) if total else 0
+    st.progress(fraction, text=f"{job['label']}: {done}"
+                + (f" of {total}" if total else "") + " done...")
+
+
+def show_job(job_id):
+    """Live progress while a job runs, then its result. Safe to call every rerun."""
+    job = jobs.get(job_id)
+    if job is None:
+        return
+    if job["status"] in jobs.ACTIVE_STATUSES:
+        poll_job(job_id)
+    else:
+        show_job_result(job)
+
+
+# --- PERFORMANCE PANEL ---
+
+
+def performance_panel(page_metrics):
+    """Sidebar view of MongoDB work per page, for spotting slow pages and N+1 queries."""
+    with st.sidebar.expander("Performance"):
+        if page_metrics:
+            st.write(
+                f"**This page:** {page_metrics['wall_ms']} ms, "
+                f"{page_metrics['queries']} queries, "
+                f"{page_metrics['commands']} round trips, "
+                f"{page_metrics['docs_returned']} docs")
+            if page_metrics["breakdown"]:
+                st.dataframe(
+                    pd.Series(page_metrics["breakdown"], name="Commands")
+                    .sort_values(ascending=False),
+                    use_container_width=True)
+
+        summary = monitoring.summary()
+        if not summary.empty:
+            st.write("**All pages since the server started**")
+            st.dataframe(summary, use_container_width=True)
+            st.download_button(
+                "Download metrics (CSV)", summary.to_csv(),
+                file_name="page_metrics.csv", mime="text/csv")
+            st.download_button(
+                "Download raw log (JSON lines)", monitoring.history_json_lines(),
+                file_name="page_metrics.jsonl", mime="application/jsonl")
+            st.button("Clear metrics", on_click=monitoring.clear_history)
+
+
+# --- SELECTORS ---
+
+
+def participant_label(participant):
+    email = participant.get("email")
+    name = participant.get("participant_name", "")
+    return f"{name} <{email}>" if email else name
+
+
+def pick_participant(key):
+    """Search box and a selectbox of matches. Returns the chosen participant's _id."""
+    query = st.text_input("Search Participants (name or email)", key=f"{key}_search")
+    matches = repository.search_participants(query, SEARCH_LIMIT)
+    labels = {p["_id"]: participant_label(p) for p in matches}
+    return st.selectbox("Select Participant", list(labels),
+                        format_func=labels.get, key=f"{key}_select")
+
+
+def pick_participants(key):
+    """Search box and a multiselect of matches. Returns the chosen _ids.
+
+    Picks are remembered in session state so they survive new searches.
+    """
+    picked = st.session_state.setdefault(f"{key}_picked", {})
+    query = st.text_input("Search Participants (name or email)", key=f"{key}_search")
+    matches = repository.search_participants(query, SEARCH_LIMIT)
+
+    labels = dict(picked)
+    labels.update((p["_id"], participant_label(p)) for p in matches)
+    selected = st.multiselect(
+        "Select Participants", list(labels), default=list(picked),
+        format_func=labels.get, key=f"{key}_select_{query}")
+
+    st.session_state[f"{key}_picked"] = {pid: labels[pid] for pid in selected}
+    return selected
+
+
+def pick_training():
+    """Selectbox of trainings by name. Returns the chosen training's _id."""
+    choices = repository.training_choices()
+    return st.selectbox("Select Training", list(choices), format_func=choices.get)
+
+
 # --- MAIN APPLICATION ---
 if not st.session_state.authenticated:
     login_page()
@@ -59,9 +253,14 @@ else:
         "Manage Participants",
         "Assign/Remove Participants to Training",
         "Track Attendance",
-        "Training Status"
+        "Training Status",
+        "Analytics",
+        "Export Attendance",
+        "Background Jobs"
     ]
     choice = st.sidebar.selectbox("Menu", menu)
+    # Every MongoDB command from here to the end of the rerun counts toward this page
+    monitoring.begin(choice)
     # --- LOGOUT BUTTON ---
     if st.sidebar.button("Logout"):
         st.session_state.authenticated = False
@@ -74,13 +273,14 @@ else:
         st.subheader("Training Management")
 
         action = st.radio("Select Action", [
-                          "Create", "View", "Edit", "Delete"])
+                          "Create", "View", "Edit", "Delete", "Holidays"])
 
         if action == "Create":
             st.subheader("Start New Training")
             training_name = st.text_input("Training Name")
             trainer_name = st.text_input("Trainer Name")
             start_date = st.date_input("Start Date", datetime.today())
+            end_date = st.date_input("End Date (optional)", value=None)
             training_days = st.multiselect(
                 "Select Training Days",
                 ["Monday", "Tuesday", "Wednesday", "Thursday",
@@ -93,50 +293,56 @@ else:
                         "training_name": training_name,
                         "trainer_name": trainer_name,
                         "start_date": start_date.strftime("%Y-%m-%d"),
-                        "training_days": training_days,
-                        "participants": []  # Empty list for participants
+                        "end_date": end_date.strftime("%Y-%m-%d") if end_date else None,
+                        "training_days": training_days
                     }
-                    trainings_collection.insert_one(training)
+                    repository.create_training(training)
                     st.success("Training Added Successfully")
                 else:
                     st.warning("Please fill all fields")
 
         elif action == "View":
             st.subheader("List of Trainings")
-            trainings = list(trainings_collection.find())
-
-            if not trainings:
-                st.write("No trainings found.")
-
-            for training in trainings:
-                st.write(
-                    f"**Training Name:** {training.get('training_name', 'N/A')}")
-                st.write(f"**Trainer:** {training.get('trainer_name', 'N/A')}")
-                st.write(
-                    f"**Start Date:** {training.get('start_date', 'N/A')}")
-                st.write(
-                    f"**Days:** {', '.join(training.get('training_days', []))}")
-                st.write(
-                    f"**Participants:** {', '.join(training.get('participants', []))}")
-                st.write("---")
+            sort_options = {
+                "Training Name": "training_name",
+                "Trainer": "trainer_name",
+                "Start Date": "start_date",
+            }
+            col1, col2, col3 = st.columns([2, 1, 3])
+            sort_label = col1.selectbox("Sort By", list(sort_options))
+            ascending = col2.radio("Order", ["Ascending", "Descending"]) == "Ascending"
+            starts_with = col3.text_input(f"{sort_label} Starts With")
+
+            sort_field = sort_options[sort_label]
+            paged_table(
+                "trainings_page",
+                (sort_field, ascending, starts_with),
+                lambda after, limit: repository.trainings_page(
+                    sort_field, ascending, starts_with, after, limit),
+                {"training_name": "Training Name", "trainer_name": "Trainer",
+                 "start_date": "Start Date", "end_date": "End Date",
+                 "training_days": "Days",
+                 "participant_count": "Participants"}
+            )
 
         elif action == "Edit":
             st.subheader("Edit Training")
-            training_list = list(trainings_collection.find())
-            training_names = [t['training_name'] for t in training_list]
-
-            selected_training = st.selectbox("Select Training", training_names)
+            selected_training = pick_training()
 
             if selected_training:
-                training_data = trainings_collection.find_one(
-                    {"training_name": selected_training})
+                training_data = repository.get_training(selected_training)
 
                 new_training_name = st.text_input(
                     "Training Name", training_data["training_name"])
                 new_trainer_name = st.text_input(
                     "Trainer Name", training_data["trainer_name"])
                 new_start_date = st.date_input("Start Date", datetime.strptime(
-                    training_data["start_date"], "%Y-%m-%d"))
+                    training_data["start_date"], "%Y-%m-%d")
+                    if training_data["start_date"] else datetime.today())
+                new_end_date = st.date_input(
+                    "End Date (optional)",
+                    datetime.strptime(training_data["end_date"], "%Y-%m-%d")
+                    if training_data.get("end_date") else None)
                 new_training_days = st.multiselect(
                     "Training Days",
                     ["Monday", "Tuesday", "Wednesday", "Thursday",
@@ -145,29 +351,48 @@ else:
                 )
 
                 if st.button("Update Training"):
-                    trainings_collection.update_one(
-                        {"training_name": selected_training},
-                        {"$set": {
-                            "training_name": new_training_name,
-                            "trainer_name": new_trainer_name,
-                            "start_date": new_start_date.strftime("%Y-%m-%d"),
-                            "training_days": new_training_days
-                        }}
-                    )
+                    repository.update_training(selected_training, {
+                        "training_name": new_training_name,
+                        "trainer_name": new_trainer_name,
+                        "start_date": new_start_date.strftime("%Y-%m-%d"),
+                        "end_date": new_end_date.strftime("%Y-%m-%d") if new_end_date else None,
+                        "training_days": new_training_days
+                    })
                     st.success("Training Updated Successfully")
 
         elif action == "Delete":
             st.subheader("Delete Training")
-            training_list = list(trainings_collection.find())
-            training_names = [t['training_name'] for t in training_list]
+            selected_training = pick_training()
+            st.write("Its attendance history and removal log are deleted too.")
 
-            selected_training = st.selectbox("Select Training", training_names)
-
-            if st.button("Delete Training"):
-                trainings_collection.delete_one(
-                    {"training_name": selected_training})
+            if st.button("Delete Training") and selected_training:
+                repository.delete_training(selected_training)
                 st.warning("Training Deleted")
 
+        elif action == "Holidays":
+            st.subheader("Holidays")
+            st.write("No training is expected to meet on these dates.")
+
+            col1, col2 = st.columns(2)
+            holiday_date = col1.date_input("Date", datetime.today())
+            holiday_name = col2.text_input("Name")
+            if st.button("Add Holiday"):
+                repository.add_holiday(holiday_date.strftime("%Y-%m-%d"), holiday_name)
+                st.success("Holiday Added")
+
+            holidays = repository.list_holidays()
+            if holidays:
+                holidays_df = pd.DataFrame(holidays, columns=["date", "name"]).rename(
+                    columns={"date": "Date", "name": "Name"})
+                holidays_df.insert(0, "Remove", False)
+                edited = st.data_editor(holidays_df, disabled=["Date", "Name"],
+                                        hide_index=True, use_container_width=True)
+                if st.button("Remove Selected"):
+                    repository.remove_holidays(list(edited.loc[edited["Remove"], "Date"]))
+                    st.rerun()
+            else:
+                st.write("No holidays added.")
+
         # --- PARTICIPANT MANAGEMENT ---
     elif choice == "Manage Participants":
         st.subheader("Participant Management")
@@ -186,32 +411,17 @@ else:
 
             file = st.file_uploader("Upload an Excel/CSV file", type=["csv", "xlsx"])
 
-            if file:
+            if file and st.button("Import Participants"):
                 try:
-                    # Reading the file content with pandas
-                    if file.name.endswith(".csv"):
-                        df = pd.read_csv(file)
-                    elif file.name.endswith(".xlsx"):
-                        df = pd.read_excel(file)
-
-                    # Check if the required columns exist
-                    if 'participant_name' in df.columns and 'email' in df.columns and 'phone' in df.columns:
-                        # Insert participants into the MongoDB database
-                        for _, row in df.iterrows():
-                            participant = {
-                                "participant_name": row["participant_name"],
-                                "email": row["email"],
-                                "phone": row["phone"]
-                            }
-                            participants_collection.insert_one(participant)
-
-                        st.success("Participants uploaded and added successfully!")
-                    else:
-                        st.error("The file must contain 'participant_name', 'email', and 'phone' columns.")
-
+                    # Runs in the background, so leaving this page does not stop it
+                    st.session_state.participant_import_job = jobs.import_participants(
+                        file, owner=st.session_state.get("username"))
                 except Exception as e:
                     st.error(f"Error processing file: {e}")
 
+            if "participant_import_job" in st.session_state:
+                show_job(st.session_state.participant_import_job)
+
         elif action == "Add":
             st.subheader("Add Participant")
             participant_name = st.text_input("Participant Name")
@@ -225,65 +435,56 @@ else:
                         "email": email,
                         "phone": phone
                     }
-                    participants_collection.insert_one(participant)
+                    repository.add_participant(participant)
                     st.success("Participant Added Successfully")
                 else:
                     st.warning("Please fill all fields")
 
         elif action == "View":
             st.subheader("List of Participants")
-            participants = list(participants_collection.find())
-
-            if not participants:
-                st.write("No participants found.")
-
-            for participant in participants:
-                st.write(
-                    f"**Name:** {participant.get('participant_name', 'N/A')}")
-                st.write(f"**Email:** {participant.get('email', 'N/A')}")
-                st.write(f"**Phone:** {participant.get('phone', 'N/A')}")
-                st.write("---")
+            sort_options = {"Name": "participant_name", "Email": "email"}
+            col1, col2, col3 = st.columns([2, 1, 3])
+            sort_label = col1.selectbox("Sort By", list(sort_options))
+            ascending = col2.radio("Order", ["Ascending", "Descending"]) == "Ascending"
+            starts_with = col3.text_input(f"{sort_label} Starts With")
+
+            sort_field = sort_options[sort_label]
+            paged_table(
+                "participants_page",
+                (sort_field, ascending, starts_with),
+                lambda after, limit: repository.participants_page(
+                    sort_field, ascending, starts_with, after, limit),
+                {"participant_name": "Name", "email": "Email", "phone": "Phone"}
+            )
 
         elif action == "Edit":
             st.subheader("Edit Participant")
-            participant_list = list(participants_collection.find())
-            participant_names = [p['participant_name'] for p in participant_list]
-
-            selected_participant = st.selectbox(
-                "Select Participant", participant_names)
+            selected_participant = pick_participant("edit_participant")
 
             if selected_participant:
-                participant_data = participants_collection.find_one(
-                    {"participant_name": selected_participant})
+                participant_data = repository.get_participant(
+                    selected_participant)
 
                 new_name = st.text_input(
                     "Participant Name", participant_data["participant_name"])
-                new_email = st.text_input("Email", participant_data["email"])
+                new_email = st.text_input("Email", participant_data.get("email", ""))
                 new_phone = st.text_input(
-                    "Phone Number", participant_data["phone"])
+                    "Phone Number", participant_data.get("phone", ""))
 
                 if st.button("Update Participant"):
-                    participants_collection.update_one(
-                        {"participant_name": selected_participant},
-                        {"$set": {
-                            "participant_name": new_name,
-                            "email": new_email,
-                            "phone": new_phone
-                        }}
-                    )
+                    repository.update_participant(selected_participant, {
+                        "participant_name": new_name,
+                        "email": new_email,
+                        "phone": new_phone
+                    })
                     st.success("Participant Updated Successfully")
 
         elif action == "Remove":
             st.subheader("Remove Participant")
-            participant_list = list(participants_collection.find())
-            participant_names = [p['participant_name'] for p in participant_list]
-
-            selected_participant = st.selectbox(
-                "Select Participant", participant_names)
+            selected_participant = pick_participant("remove_participant")
 
-            if st.button("Remove Participant"):
-                participants_collection.delete_one(
-                    {"participant_name": selected_participant})
+            if st.button("Remove Participant") and selected_participant:
+                repository.delete_participant(selected_participant)
                 st.warning("Participant Removed")
 
 
@@ -292,50 +493,32 @@ else:
     elif choice == "Assign/Remove Participants to Training":
         st.subheader("Assign Participants")
 
-        training_list = list(trainings_collection.find())
-        training_names = [t['training_name'] for t in training_list]
+        selected_training = pick_training()
+        selected_participants = pick_participants("assign_participants")
 
-        participant_list = list(participants_collection.find())
-        participant_names = [p['participant_name'] for p in participant_list]
-
-        selected_training = st.selectbox("Select Training", training_names)
-        selected_participants = st.multiselect(
-            "Select Participants", participant_names)
-
-        if st.button("Assign"):
-            trainings_collection.update_one(
-                {"training_name": selected_training},
-                {"$addToSet": {"participants": {"$each": selected_participants}}}
-            )
+        if st.button("Assign") and selected_training:
+            repository.assign_participants(
+                selected_training, selected_participants)
             st.success("Participants Assigned Successfully")
         
         st.markdown("---")
         st.subheader("Remove Participants from Training")
 
-        participants_in_training = trainings_collection.find_one(
-            {"training_name": selected_training}
-        ).get("participants", [])
+        participants_in_training = {
+            p["_id"]: participant_label(p)
+            for p in repository.training_participants(selected_training)
+        }
 
-        participants_to_remove = st.multiselect("Select Participants to Remove", participants_in_training)
+        participants_to_remove = st.multiselect(
+            "Select Participants to Remove", list(participants_in_training),
+            format_func=participants_in_training.get)
         removal_reason = st.text_input("Reason for Removal")
 
         if st.button("Remove Selected Participants"):
             if participants_to_remove and removal_reason:
-                # Remove from training
-                trainings_collection.update_one(
-                    {"training_name": selected_training},
-                    {"$pull": {"participants": {"$in": participants_to_remove}}}
-                )
-
-                # Record the removals with reason and timestamp
-                removal_records = [{
-                    "training_name": selected_training,
-                    "participant_name": name,
-                    "reason": removal_reason,
-                    "removed_on": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                } for name in participants_to_remove]
-
-                db["removals"].insert_many(removal_records)
+                # Remove from training and record the removals
+                repository.remove_participants(
+                    selected_training, participants_to_remove, removal_reason)
 
                 st.success("Participants removed and recorded successfully.")
             elif not removal_reason:
@@ -346,14 +529,15 @@ else:
         st.markdown("---")
         st.subheader("Past Removals")
 
-        removal_logs = list(db["removals"].find({"training_name": selected_training}))
-
-        if removal_logs:
-            removal_df = pd.DataFrame(removal_logs)
-            removal_df.drop(columns=["_id"], inplace=True, errors="ignore")
-            st.dataframe(removal_df, use_container_width=True)
-        else:
-            st.write("No removals recorded for this training.")
+        removed_starts_with = st.text_input("Participant Name Starts With")
+        paged_table(
+            "removals_page",
+            (selected_training, removed_starts_with),
+            lambda after, limit: repository.removals_page(
+                selected_training, removed_starts_with, after, limit),
+            {"participant_name": "Participant Name", "reason": "Reason",
+             "removed_on": "Removed On"}
+        )
 
 
 
@@ -362,54 +546,146 @@ else:
     if choice == "Track Attendance":
         st.subheader("Mark Attendance")
 
-        # Fetch the list of trainings and participants
-        training_list = list(trainings_collection.find())
-        training_names = [t['training_name'] for t in training_list]
-
-        selected_training = st.selectbox("Select Training", training_names)
+        selected_training = pick_training()
 
         if selected_training:
             # Fetch training data and participants for the selected training
-            training_data = trainings_collection.find_one({"training_name": selected_training})
-            # Get currently assigned participants
-            participant_names = training_data.get("participants", [])
-
-            # Get names of previously removed participants
-            removed_participants = db["removals"].find(
-                {"training_name": selected_training}, {"participant_name": 1}
-            )
-            removed_names = {entry["participant_name"] for entry in removed_participants}
-
-            # Filter out removed ones
-            participant_names = [p for p in participant_names if p not in removed_names]
-
-
-            # Select the date for attendance marking
-            selected_date = st.date_input("Select Date", datetime.today())
-
-            # Input for the topic of the day
-            topic_of_the_day = st.text_input("Topic for the Day")
-
-            if participant_names:
-                attendance_status = {}
-                # Record the attendance status for each participant
-                for participant in participant_names:
-                    attendance_status[participant] = st.checkbox(f"Present: {participant}", value=True)
-
-                if st.button("Save Attendance"):
-                    if topic_of_the_day:  # Ensure that topic is provided
-                        # Create attendance record to store in the database
-                        attendance_record = {
-                            "training_name": selected_training,
-                            "date": selected_date.strftime("%Y-%m-%d"),
-                            "topic": topic_of_the_day,
-                            "attendance": attendance_status
-                        }
-                        # Insert the record into the attendance collection
-                        attendance_collection.insert_one(attendance_record)
+            training_data = repository.get_training(selected_training)
+            # Get previously removed participants
+            removed_ids = repository.removed_participant_ids(selected_training)
+
+            # Currently assigned participants, without removed ones
+            participants = [
+                p for p in repository.training_participants(selected_training)
+                if p["_id"] not in removed_ids
+            ]
+
+            with st.expander("Import from a Training Status sheet"):
+                st.write("Upload a sheet with participant names in the first "
+                         "column and one \"P\"/\"A\" column per date, headed "
+                         "YYYY-MM-DD or YYYY-MM-DD (topic). Only new or changed "
+                         "sessions are saved.")
+                status_file = st.file_uploader(
+                    "Upload an Excel/CSV file", type=["csv", "xlsx"],
+                    key=f"status_sheet_{selected_training}")
+
+                if status_file:
+                    # Diff once per upload; reruns reuse the plan until it is applied
+                    plan_key = (selected_training, status_file.file_id)
+                    if st.session_state.get("status_plan", (None,))[0] != plan_key:
+                        try:
+                            st.session_state.status_plan = (
+                                plan_key,
+                                importer.plan_attendance_import(
+                                    selected_training, status_file))
+                        except ValueError as e:
+                            st.session_state.pop("status_plan", None)
+                            st.error(str(e))
+
+                    plan = st.session_state.get("status_plan", (None, None))[1]
+                    if plan:
+                        st.dataframe(plan["summary"], use_container_width=True,
+                                     hide_index=True)
+                        if plan["errors"]:
+                            st.warning(f"{len(plan['errors'])} problems; "
+                                       "these cells will be skipped:")
+                            st.dataframe(pd.DataFrame(plan["errors"]),
+                                         use_container_width=True, hide_index=True)
+
+                        if not plan["sessions"]:
+                            st.info("The saved attendance already matches this sheet.")
+                        elif st.button(f"Apply {len(plan['sessions'])} sessions"):
+                            st.session_state.status_import_job = \
+                                jobs.apply_attendance_import(
+                                    selected_training, plan["sessions"],
+                                    f"Import {status_file.name}",
+                                    owner=st.session_state.get("username"))
+                            st.session_state.pop("status_plan", None)
+
+                if "status_import_job" in st.session_state:
+                    show_job(st.session_state.status_import_job)
+
+
+            # Select one date, a range expanded to the training's schedule,
+            # or every scheduled date that has no saved session yet
+            mode = st.radio("Dates", ["One date", "Several dates",
+                                      "Sessions not yet recorded"], horizontal=True)
+            if mode == "Several dates":
+                date_range = st.date_input(
+                    "Select Dates", (datetime.today(), datetime.today()))
+                start_date = date_range[0] if date_range else datetime.today()
+                end_date = date_range[-1] if date_range else start_date
+                selected_dates = schedule.expected_dates(
+                    training_data, start_date.strftime("%Y-%m-%d"),
+                    end_date.strftime("%Y-%m-%d"))[:MAX_GRID_DATES]
+            elif mode == "Sessions not yet recorded":
+                unrecorded = schedule.unrecorded_dates(training_data)
+                if len(unrecorded) > MAX_GRID_DATES:
+                    st.info(f"{len(unrecorded)} sessions are not recorded; "
+                            f"showing the oldest {MAX_GRID_DATES}.")
+                selected_dates = unrecorded[:MAX_GRID_DATES]
+            else:
+                selected_date = st.date_input("Select Date", datetime.today())
+                selected_dates = [selected_date.strftime("%Y-%m-%d")]
+
+            if not selected_dates and mode == "Sessions not yet recorded":
+                st.success("Every scheduled session so far has been recorded.")
+            elif not selected_dates:
+                st.warning("No training sessions are scheduled in the selected range.")
+            elif participants:
+                grid, topics = attendance.session_grid(
+                    selected_training, [p["_id"] for p in participants],
+                    selected_dates)
+
+                # Bulk actions overwrite the whole grid until the selection changes
+                grid_key = (selected_training, tuple(selected_dates))
+                col1, col2 = st.columns(2)
+                if col1.button("Mark all present"):
+                    st.session_state.attendance_fill = (grid_key, True)
+                if col2.button("Mark all absent"):
+                    st.session_state.attendance_fill = (grid_key, False)
+                fill = st.session_state.get("attendance_fill")
+                if fill and fill[0] == grid_key:
+                    grid.loc[:, :] = fill[1]
+
+                # Edits stay in the browser until the form is submitted
+                with st.form("attendance_form"):
+                    topics_df = st.data_editor(
+                        pd.DataFrame({"Date": list(topics), "Topic": list(topics.values())}),
+                        disabled=["Date"], hide_index=True, use_container_width=True,
+                        key=f"topics_{grid_key}_{fill}"
+                    )
+                    # Rows are matched back to participant ids by position
+                    editor_df = grid.reset_index(drop=True)
+                    editor_df.insert(0, "Participant",
+                                     [participant_label(p) for p in participants])
+                    edited = st.data_editor(
+                        editor_df,
+                        column_config={
+                            date: st.column_config.CheckboxColumn(date)
+                            for date in selected_dates
+                        },
+                        disabled=["Participant"], hide_index=True,
+                        use_container_width=True,
+                        key=f"grid_{grid_key}_{fill}"
+                    )
+                    edited_grid = pd.DataFrame(
+                        edited[selected_dates].to_numpy(dtype=bool),
+                        index=grid.index, columns=selected_dates)
+                    submitted = st.form_submit_button("Save Attendance")
+
+                if submitted:
+                    topics = dict(zip(topics_df["Date"], topics_df["Topic"].fillna("")))
+                    if all(topic.strip() for topic in topics.values()):
+                        # Every selected date is written in one bulk request
+                        attendance.save_sessions(
+                            selected_training,
+                            attendance.sessions_from_grid(
+                                selected_training, edited_grid, topics))
+                        st.session_state.pop("attendance_fill", None)
                         st.success("Attendance and Topic Saved Successfully")
                     else:
-                        st.warning("Please provide a topic for the day.")
+                        st.warning("Please provide a topic for each date.")
             else:
                 st.warning("No participants assigned to this training.")
 
@@ -418,16 +694,15 @@ else:
     if choice == "Training Status":
         st.subheader("Training Status Overview")
 
-        training_list = list(trainings_collection.find())
-        training_names = [t['training_name'] for t in training_list]
-
-        if training_names:
-            selected_training = st.selectbox("Select Training", training_names)
+        if repository.training_choices():
+            selected_training = pick_training()
 
             if selected_training:
-                training_data = trainings_collection.find_one(
-                    {"training_name": selected_training})
-                participant_names = training_data.get("participants", [])
+                training_data = repository.get_training(selected_training)
+                participant_names = {
+                    p["_id"]: p["participant_name"]
+                    for p in repository.training_participants(selected_training)
+                }
 
                 st.write(
                     f"**Training Name:** {training_data.get('training_name', 'N/A')}")
@@ -436,58 +711,168 @@ else:
                 st.write(
                     f"**Days:** {', '.join(training_data.get('training_days', []))}")
 
-                # Fetch attendance records for the selected training
-                attendance_records = list(attendance_collection.find(
-                    {"training_name": selected_training}))
-
-                if attendance_records:
-                    # Map each date to its topic
-                    date_topic_map = {}
-                    for record in attendance_records:
-                        date = record["date"]
-                        topic = record.get("topic", "")
-                        date_topic_map[date] = topic
-
-                    # Sort dates
-                    dates = sorted(date_topic_map.keys())
-
-                    # Create attendance matrix with raw dates as keys
-                    attendance_data = {
-                        participant: {date: "A" for date in dates} for participant in participant_names
-                    }
-
-                    for record in attendance_records:
-                        date = record["date"]
-                        for participant, status in record["attendance"].items():
-                            attendance_data[participant][date] = "P" if status else "A"
+                # Build the participant x date matrix from server-side marks,
+                # with a column for every session scheduled so far
+                present, topics = attendance.attendance_matrix(
+                    selected_training, list(participant_names),
+                    schedule.expected_dates(training_data))
+                recorded = topics.notna().to_numpy()
 
-                    # Create DataFrame using raw date keys first
-                    attendance_df = pd.DataFrame.from_dict(
-                        attendance_data, orient="index"
-                    )
-                    attendance_df = attendance_df[dates]  # Ensure column order
-
-                    # Rename columns to include topics
-                    columns_with_topics = {
-                        date: f"{date}\n({date_topic_map[date]})" if date_topic_map[date] else date
-                        for date in dates
-                    }
-                    attendance_df.rename(columns=columns_with_topics, inplace=True)
+                if not recorded.all():
+                    st.write(f"**Sessions not yet recorded:** {(~recorded).sum()}")
 
+                if len(topics):
+                    attendance_df = attendance.status_table(present, topics)
+                    attendance_df.index = present.index.map(participant_names)
                     attendance_df.index.name = "Participant Name"
-                    # Function to highlight absentees
-                    def highlight_absentees(val):
-                        if val == "A":
-                            return 'background-color: #ffcccc; color: red; font-weight: bold;'
-                        return ''
 
-                    # Apply the style
-                    styled_df = attendance_df.style.applymap(highlight_absentees)
-
-                    # Display the styled DataFrame
                     st.write("### Attendance Records")
-                    st.dataframe(styled_df, use_container_width=True)
+                    # Styling ships CSS for every cell, so only small
+                    # matrices get the absentee highlight
+                    if attendance_df.size <= STYLED_MATRIX_MAX_CELLS:
+                        styled_df = attendance_df.style.apply(
+                            attendance.highlight_absentees, axis=None)
+                        st.dataframe(styled_df, use_container_width=True)
+                    else:
+                        st.dataframe(attendance_df, use_container_width=True)
+
+                    st.write("### Summary")
+                    summary = attendance.attendance_summary(present, recorded).join(
+                        attendance.streaks(selected_training))
+                    summary.index = summary.index.map(participant_names)
+                    summary.index.name = "Participant Name"
+                    st.dataframe(summary, use_container_width=True)
                 else:
                     st.write("No attendance records available.")
         else:
             st.write("No trainings available.")
+
+
+    # --- ANALYTICS PAGE ---
+    if choice == "Analytics":
+        st.subheader("Attendance Analytics")
+
+        col1, col2 = st.columns(2)
+        start_date = col1.date_input(
+            "From", datetime.today() - timedelta(days=365), key="analytics_from")
+        end_date = col2.date_input("To", datetime.today(), key="analytics_to")
+
+        # One cached aggregation; every breakdown below is a pandas groupby
+        sessions = analytics.session_frame(
+            start_date.strftime("%Y-%m-%d") if start_date else None,
+            end_date.strftime("%Y-%m-%d") if end_date else None)
+
+        if sessions.empty:
+            st.write("No attendance records in this period.")
+        else:
+            overview = analytics.overview(sessions)
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Attendance", f"{overview['rate']}%")
+            col2.metric("Sessions", overview["sessions"])
+            col3.metric("Trainings", overview["trainings"])
+            col4.metric("Marks", overview["marks"])
+
+            tooltip = ["Sessions", "Present", "Marks", "Attendance %"]
+
+            st.write("### By Month")
+            by_month = analytics.attendance_rates(sessions, "month")
+            st.altair_chart(alt.Chart(by_month).mark_line(point=True).encode(
+                x=alt.X("month:O", title="Month"),
+                y=alt.Y("Attendance %:Q", scale=alt.Scale(domain=[0, 100])),
+                tooltip=["month"] + tooltip,
+            ), use_container_width=True)
+
+            col1, col2 = st.columns(2)
+            with col1:
+                st.write("### By Weekday")
+                by_weekday = analytics.attendance_rates(sessions, "weekday")
+                st.altair_chart(alt.Chart(by_weekday).mark_bar().encode(
+                    x=alt.X("weekday:N", title="Weekday",
+                            sort=analytics.WEEKDAY_ORDER),
+                    y=alt.Y("Attendance %:Q", scale=alt.Scale(domain=[0, 100])),
+                    tooltip=["weekday"] + tooltip,
+                ), use_container_width=True)
+            with col2:
+                st.write("### By Trainer")
+                by_trainer = analytics.attendance_rates(sessions, "trainer")
+                st.altair_chart(alt.Chart(by_trainer).mark_bar().encode(
+                    x=alt.X("Attendance %:Q", scale=alt.Scale(domain=[0, 100])),
+                    y=alt.Y("trainer:N", title="Trainer", sort="-x"),
+                    tooltip=["trainer"] + tooltip,
+                ), use_container_width=True)
+
+            st.write("### By Training")
+            by_training = analytics.attendance_rates(
+                sessions, ["training_id", "training", "trainer"])
+            st.dataframe(
+                by_training.drop(columns="training_id")
+                .rename(columns={"training": "Training", "trainer": "Trainer"})
+                .sort_values("Attendance %"),
+                use_container_width=True, hide_index=True)
+
+
+    # --- EXPORT ATTENDANCE PAGE ---
+    if choice == "Export Attendance":
+        st.subheader("Export Attendance")
+
+        choices = repository.training_choices()
+        if st.checkbox("All trainings", value=True):
+            training_ids = None
+        else:
+            training_ids = st.multiselect(
+                "Select Trainings", list(choices), format_func=choices.get)
+
+        # Leave either end empty to export from the first or up to the last session
+        col1, col2 = st.columns(2)
+        start_date = col1.date_input("From", value=None)
+        end_date = col2.date_input("To", value=None)
+        file_format = st.selectbox(
+            "Format", list(exporter.EXPORT_FORMATS), format_func=str.upper)
+
+        if st.button("Start Export"):
+            if training_ids == []:
+                st.warning("Please select at least one training.")
+            else:
+                # Sessions are streamed from MongoDB into a file in the background
+                st.session_state.export_job = jobs.export_attendance(
+                    file_format, training_ids,
+                    start_date.strftime("%Y-%m-%d") if start_date else None,
+                    end_date.strftime("%Y-%m-%d") if end_date else None,
+                    owner=st.session_state.get("username"))
+
+        if "export_job" in st.session_state:
+            show_job(st.session_state.export_job)
+
+
+    # --- BACKGROUND JOBS PAGE ---
+    if choice == "Background Jobs":
+        st.subheader("Background Jobs")
+
+        if st.button("Rebuild attendance rollups"):
+            jobs.rebuild_rollups(owner=st.session_state.get("username"))
+        st.button("Refresh")
+
+        recent_jobs = jobs.recent(owner=st.session_state.get("username"))
+        if recent_jobs:
+            st.dataframe(pd.DataFrame([{
+                "Job": job["label"],
+                "Status": job["status"],
+                "Progress": job["progress"]["done"],
+                "Of": job["progress"]["total"],
+                "Started": job["created_at"],
+                "Finished": job["finished_at"],
+            } for job in recent_jobs]), use_container_width=True, hide_index=True)
+
+            labels = {job["_id"]: f"{job['label']} ({job['created_at']:%Y-%m-%d %H:%M})"
+                      for job in recent_jobs}
+            selected_job = st.selectbox(
+                "Show job", list(labels), format_func=labels.get)
+            show_job(selected_job)
+        else:
+            st.write("No background jobs yet.")
+
+
+    # --- PERFORMANCE ---
+    page_metrics = monitoring.end()
+    if st.session_state.get("username") in ADMIN_USERS:
+        performance_panel(page_metrics)
@@ -0,0 +1,174 @@
+"""Attendance saving, matrix and summary calculations.
+
+MongoDB flattens the stored attendance into one row per (date, participant)
+and the matrix is filled with a single NumPy scatter, so no Python loop runs
+per participant or per date.
+"""
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+
+import repository
+import rollups
+
+ABSENT_STYLE = "background-color: #ffcccc; color: red; font-weight: bold;"
+NOT_RECORDED_STYLE = "color: gray;"
+
+# Cell shown for a scheduled session nobody has recorded yet
+NOT_RECORDED = "-"
+
+
+def compact_record(training_id, date, topic, marks):
+    """Build the stored form of a session from a {participant_id: bool} dict."""
+    return {
+        "training_id": training_id,
+        "date": date,
+        "topic": topic,
+        "participant_ids": list(marks),
+        "present": [bool(status) for status in marks.values()],
+    }
+
+
+def save_sessions(training_id, sessions):
+    """Save several sessions of one training with a single bulk write.
+
+    sessions is a list of {"date", "topic", "attendance"} dicts where
+    attendance maps participant _id to True/False. The rollup is updated
+    with the same save; see rollups.save_sessions().
+    """
+    rollups.save_sessions([
+        compact_record(training_id, s["date"], s["topic"], s["attendance"])
+        for s in sessions
+    ])
+
+
+def session_grid(training_id, participant_ids, dates):
+    """Return (grid, topics) for marking attendance on several dates at once.
+
+    grid is a boolean DataFrame of participant _ids by date pre-filled with
+    any saved marks (present for dates not saved yet); topics maps each date
+    to its saved topic or "".
+    """
+    participants = pd.Index(participant_ids).unique()
+    grid = pd.DataFrame(True, index=participants, columns=list(dates))
+    topics = dict.fromkeys(dates, "")
+
+    for date, (topic, marks) in repository.saved_attendance(training_id, dates).items():
+        grid[date] = pd.Series(marks, dtype=bool).reindex(
+            participants, fill_value=False)
+        topics[date] = topic
+    return grid, topics
+
+
+def sessions_from_grid(training_id, grid, topics):
+    """Turn an edited grid back into the session dicts save_sessions() takes.
+
+    The grid only has rows for current participants, so saved marks for
+    anyone removed since are kept rather than dropped with the rewrite.
+    """
+    saved = repository.saved_attendance(training_id, list(grid.columns))
+    return [
+        {"date": date, "topic": topics[date],
+         "attendance": {**saved.get(date, (None, {}))[1],
+                        **grid[date].astype(bool).to_dict()}}
+        for date in grid.columns
+    ]
+
+
+def attendance_matrix(training_id, participant_ids, expected_dates=()):
+    """Return (present, topics) for a training.
+
+    present is a boolean DataFrame indexed by participant _id with one column
+    per recorded or expected date in order; anyone without a mark on a date
+    counts as absent. topics maps each date to the topic saved with it, or
+    None for an expected date that has not been recorded.
+    """
+    marks = pd.DataFrame(
+        repository.attendance_marks(training_id),
+        columns=["date", "topic", "participant_id", "present"]
+    )
+    participants = pd.Index(participant_ids).unique()
+
+    topics = (
+        marks.drop_duplicates("date", keep="last")
+        .set_index("date")["topic"]
+        .fillna("")
+    )
+    topics = topics.reindex(topics.index.union(pd.Index(expected_dates)))
+    topics = topics.astype(object).where(topics.notna(), None)
+    dates = topics.index
+
+    present = np.zeros((len(participants), len(dates)), dtype=bool)
+    marks = marks.dropna(subset=["participant_id"])
+    if not marks.empty:
+        rows = participants.get_indexer(marks["participant_id"])
+        columns = dates.get_indexer(marks["date"])
+        # Marks for people no longer on the training are dropped
+        known = rows >= 0
+        present[rows[known], columns[known]] = \
+            marks["present"].to_numpy(dtype=bool)[known]
+
+    return pd.DataFrame(present, index=participants, columns=dates), topics
+
+
+def attendance_summary(present, recorded=None):
+    """Per-participant present/absent counts and attendance percentage.
+
+    recorded flags which columns were saved (all of them if None). Scheduled
+    sessions nobody recorded are counted separately but still count against
+    the percentage, since the participant was not marked present.
+    """
+    sessions = present.shape[1]
+    recorded = np.ones(sessions, dtype=bool) if recorded is None else np.asarray(recorded, dtype=bool)
+    attended = present.to_numpy(dtype=bool).sum(axis=1)
+    percentage = np.round(attended / sessions * 100, 1) if sessions else np.zeros(len(attended))
+    return pd.DataFrame({
+        "Present": attended,
+        "Absent": recorded.sum() - attended,
+        "Not Recorded": sessions - recorded.sum(),
+        "Attendance %": percentage,
+    }, index=present.index)
+
+
+def streaks(training_id):
+    """Last attended date and streaks per participant _id, read from the rollup."""
+    rollup = rollups.current(training_id)
+    columns = {
+        "last_attended": "Last Attended",
+        "current_streak": "Current Streak",
+        "longest_streak": "Longest Streak",
+    }
+    table = pd.DataFrame.from_dict(
+        rollup["participants"], orient="index", columns=list(columns)
+    ).rename(columns=columns)
+    table.index = table.index.map(ObjectId)
+    return table
+
+
+def column_label(date, topic):
+    """Header used for a session in the status table and in exports."""
+    return f"{date}\n({topic})" if topic else date
+
+
+def status_table(present, topics):
+    """Render the boolean matrix as the "P"/"A" table shown to trainers.
+
+    Scheduled dates with no saved session show NOT_RECORDED instead.
+    """
+    cells = np.where(present.to_numpy(), "P", "A")
+    cells[:, topics.isna().to_numpy()] = NOT_RECORDED
+    return pd.DataFrame(
+        cells,
+        index=present.index,
+        columns=[column_label(date, topic) for date, topic in topics.items()]
+    )
+
+
+def highlight_absentees(table):
+    """Style every "A" cell in one vectorised pass instead of a per-cell callback."""
+    cells = table.to_numpy()
+    return pd.DataFrame(
+        np.select([cells == "A", cells == NOT_RECORDED],
+                  [ABSENT_STYLE, NOT_RECORDED_STYLE], ""),
+        index=table.index, columns=table.columns
+    )
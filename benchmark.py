@@ -0,0 +1,370 @@
+"""Benchmarks for the data paths behind each page.
+
+Usage:
+    python benchmark.py run [--backend mongod|mongomock] [--drop]
+                            [volume options] [--repeat N] [--output FILE]
+                            seed a throwaway database and time every path
+    python benchmark.py compare OLD.json NEW.json
+                            show the median change between two runs
+
+run drops and reseeds the --database (training_benchmark by default) on the
+server at MONGODB_URL, which it only does when given --drop and never for the
+application's MONGODB_DB_NAME. --backend mongomock uses an in-memory client
+instead (pip install mongomock; much slower than mongod, so use smaller
+volumes). Data is generated from --seed, so two runs with the same
+options time the same workload. Results are written as JSON including the
+git commit, so runs can be compared across commits.
+"""
+import argparse
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+
+import attendance
+import db
+import exporter
+import importer
+import migrations
+import monitoring
+import repository
+import rollups
+import schedule
+
+FIRST_NAMES = ["Ali", "Ayesha", "Bilal", "Fatima", "Hamza", "Hira", "Imran", "Maryam",
+               "Naeem", "Noor", "Rehan", "Sana", "Usman", "Zainab", "Omar", "Amna"]
+LAST_NAMES = ["Khan", "Ahmed", "Malik", "Hussain", "Syed", "Butt", "Qureshi", "Shah",
+              "Raza", "Iqbal", "Chaudhry", "Mirza"]
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+
+# Documents per insert_many while seeding
+SEED_BATCH_SIZE = 10000
+
+
+# --- BACKENDS ---
+
+
+def _mongomock_client():
+    try:
+        import mongomock
+        import mongomock.collection
+    except ImportError:
+        sys.exit("The mongomock backend needs: pip install mongomock")
+
+    # pymongo 4.11 passes a sort option to bulk updates that mongomock does
+    # not know about; it is never used by this app
+    builder = mongomock.collection.BulkOperationBuilder
+    for method in ("add_update", "add_replace"):
+        original = getattr(builder, method)
+        setattr(builder, method,
+                lambda self, *args, sort=None, _original=original, **kwargs:
+                _original(self, *args, **kwargs))
+    return mongomock.MongoClient()
+
+
+# Databases a benchmark never drops, on top of the application's own
+PROTECTED_DATABASES = {"admin", "config", "local"}
+
+
+def connect(backend, database, drop=False):
+    """Point db at an emptied benchmark database.
+
+    Returns a reason instead when doing so could destroy real data: the
+    database is the application's (or a system one), or it lives on a real
+    server and drop was not confirmed.
+    """
+    if database == db.MONGODB_DB_NAME or database in PROTECTED_DATABASES:
+        return f"{database} is not a throwaway database; pick another --database."
+    if backend == "mongod" and not drop:
+        return (f"This drops {database} on {db.MONGODB_URL}; "
+                "pass --drop to confirm.")
+    if backend == "mongomock":
+        db.set_client(_mongomock_client())
+    db.MONGODB_DB_NAME = database
+    db.get_client().drop_database(database)
+    repository.invalidate_cache()
+    return None
+
+
+# --- SYNTHETIC DATA ---
+
+
+def _insert(collection, documents):
+    for start in range(0, len(documents), SEED_BATCH_SIZE):
+        collection.insert_many(documents[start:start + SEED_BATCH_SIZE], ordered=False)
+
+
+def participant_documents(rng, count, prefix=""):
+    first = rng.choice(FIRST_NAMES, count)
+    last = rng.choice(LAST_NAMES, count)
+    return [
+        repository.with_search_keys({
+            "_id": ObjectId(),
+            "participant_name": f"{f} {l}",
+            "email": f"{prefix}{f.lower()}.{l.lower()}{i}@example.com",
+            "phone": f"03{rng.integers(0, 10**9):09d}",
+        })
+        for i, (f, l) in enumerate(zip(first, last))
+    ]
+
+
+def seed(args):
+    """Fill the database with the requested volumes; returns what was created."""
+    # Migrating the empty database builds the indexes before the data arrives
+    migrations.migrate()
+    rng = np.random.default_rng(args.seed)
+    participants = participant_documents(rng, args.participants)
+    _insert(db.participants_collection(), participants)
+    participant_ids = np.array([p["_id"] for p in participants], dtype=object)
+
+    first_day = pd.Timestamp(datetime.today().date()) - timedelta(days=args.days)
+    trainings, sessions = [], []
+    for i in range(args.trainings):
+        start = first_day + timedelta(days=int(rng.integers(0, args.days)))
+        days = sorted(rng.choice(WEEKDAYS, int(rng.integers(2, 4)), replace=False),
+                      key=WEEKDAYS.index)
+        members = list(rng.choice(
+            participant_ids, min(args.per_training, len(participant_ids)), replace=False))
+        training = repository.with_lowered_fields({
+            "_id": ObjectId(),
+            "training_name": f"Training {i:05d}",
+            "trainer_name": f"Trainer {i % 50:02d}",
+            "start_date": start.strftime("%Y-%m-%d"),
+            "training_days": list(days),
+            "participant_ids": members,
+        })
+        trainings.append(training)
+
+        # Sessions on the training's days from its start up to today
+        dates = pd.date_range(start, first_day + timedelta(days=args.days))
+        dates = dates[dates.day_name().isin(days)][:args.sessions_per_training]
+        present = rng.random((len(dates), len(members))) < args.attendance_rate
+        for date, marks in zip(dates.strftime("%Y-%m-%d"), present):
+            sessions.append({
+                "training_id": training["_id"], "date": date,
+                "topic": f"Topic {date}", "participant_ids": members,
+                "present": marks.tolist(),
+            })
+
+    _insert(db.trainings_collection(), trainings)
+    _insert(db.attendance_collection(), sessions)
+    rollups.rebuild()
+    return {
+        "participants": len(participants),
+        "trainings": len(trainings),
+        "sessions": len(sessions),
+        "marks": sum(len(s["participant_ids"]) for s in sessions),
+    }
+
+
+# --- PATHS ---
+# Each path does what one page does for a single rerun, given the repeat index.
+
+
+def benchmark_paths(args):
+    rng = np.random.default_rng(args.seed + 1)
+    training_ids = sorted(repository.attendance_training_ids())
+    picks = [training_ids[i] for i in rng.integers(0, len(training_ids), args.repeat)]
+    prefixes = rng.choice([n[:2].lower() for n in FIRST_NAMES], args.repeat)
+
+    def training_status(i):
+        participants = repository.training_participants(picks[i])
+        present, topics = attendance.attendance_matrix(
+            picks[i], [p["_id"] for p in participants],
+            schedule.expected_dates(repository.get_training(picks[i])))
+        attendance.status_table(present, topics)
+        attendance.attendance_summary(present, topics.notna().to_numpy()).join(
+            attendance.streaks(picks[i]))
+
+    def attendance_grid(i):
+        participants = repository.training_participants(picks[i])
+        last = rollups.current(picks[i])["last_session"]
+        dates = pd.date_range(end=last, periods=5).strftime("%Y-%m-%d")
+        attendance.session_grid(picks[i], [p["_id"] for p in participants], dates)
+
+    def save_new_date(i):
+        training = repository.get_training(picks[i])
+        rollup = rollups.current(picks[i])
+        date = (pd.Timestamp(rollup["last_session"] or training["start_date"])
+                + timedelta(days=1)).strftime("%Y-%m-%d")
+        attendance.save_sessions(picks[i], [{
+            "date": date, "topic": "Benchmark",
+            "attendance": {pid: True for pid in training["participant_ids"]},
+        }])
+
+    def save_correction(i):
+        date, (topic, marks) = next(iter(repository.saved_attendance(
+            picks[i], [rollups.current(picks[i])["last_session"]]).items()))
+        attendance.save_sessions(picks[i], [{
+            "date": date, "topic": topic,
+            "attendance": {pid: not present for pid, present in marks.items()},
+        }])
+
+    # Upload files are built up front so only the import itself is timed
+    uploads = [
+        pd.DataFrame(participant_documents(rng, args.upload_rows, prefix=f"upload{i}."))
+        [importer.PARTICIPANT_COLUMNS].to_csv(index=False).encode()
+        for i in range(args.repeat)
+    ]
+
+    def bulk_upload(i):
+        data = io.BytesIO(uploads[i])
+        data.name = "participants.csv"
+        importer.import_participants(data)
+
+    def export_training(i):
+        exporter.export_attendance(io.BytesIO(), "csv", [picks[i]])
+
+    return {
+        "Manage Trainings: view page": lambda i: repository.trainings_page(limit=50),
+        "Manage Participants: view page": lambda i: repository.participants_page(limit=50),
+        "Participant search": lambda i: repository.search_participants(prefixes[i]),
+        "Training selector": lambda i: repository.training_choices(),
+        "Training Status: matrix": training_status,
+        "Track Attendance: grid": attendance_grid,
+        "Track Attendance: save new date": save_new_date,
+        "Track Attendance: save correction": save_correction,
+        "Bulk Upload": bulk_upload,
+        "Export: one training": export_training,
+    }
+
+
+def time_path(name, path, repeat):
+    samples, records = [], []
+    for i in range(repeat):
+        # Measure the MongoDB path, not the read cache
+        repository.invalidate_cache()
+        with monitoring.measure(f"benchmark: {name}") as record:
+            path(i)
+        samples.append(record["wall_ms"])
+        records.append(record)
+    samples = np.array(samples)
+    return {
+        "repeat": repeat,
+        "min_ms": round(float(samples.min()), 2),
+        "median_ms": round(float(np.median(samples)), 2),
+        "p95_ms": round(float(np.percentile(samples, 95)), 2),
+        "mean_ms": round(float(samples.mean()), 2),
+        "commands": max(r["commands"] for r in records),
+        "docs_returned": max(r["docs_returned"] for r in records),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- COMMANDS ---
+
+
+def cmd_run(args):
+    refused = connect(args.backend, args.database, args.drop)
+    if refused:
+        print(refused)
+        return 1
+    started = time.perf_counter()
+    volumes = seed(args)
+    seed_seconds = round(time.perf_counter() - started, 2)
+    print(f"Seeded {volumes} in {seed_seconds}s")
+
+    results = {}
+    for name, path in benchmark_paths(args).items():
+        results[name] = time_path(name, path, args.repeat)
+        print(f"{name:<40} median {results[name]['median_ms']:>9} ms  "
+              f"p95 {results[name]['p95_ms']:>9} ms  "
+              f"{results[name]['commands']:>4} commands")
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "backend": args.backend,
+        "python": platform.python_version(),
+        "options": {k: v for k, v in vars(args).items() if k != "func"},
+        "volumes": volumes,
+        "seed_seconds": seed_seconds,
+        "results": results,
+    }
+    output = args.output or f"benchmark-{commit or 'unknown'}-{args.backend}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if not args.keep:
+        db.get_client().drop_database(args.database)
+    return 0
+
+
+def cmd_compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    if old["volumes"] != new["volumes"] or old["backend"] != new["backend"]:
+        print("Warning: the runs used different volumes or backends.")
+
+    print(f"{'':<40} {old['commit'] or 'old':>10} {new['commit'] or 'new':>10}  change")
+    for name, result in new["results"].items():
+        before = old["results"].get(name, {}).get("median_ms")
+        after = result["median_ms"]
+        change = f"{(after - before) / before * 100:+.0f}%" if before else "new"
+        print(f"{name:<40} {before if before is not None else '-':>10} {after:>10}  {change}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="seed a throwaway database and time every path")
+    run.add_argument("--backend", choices=["mongod", "mongomock"], default="mongod")
+    run.add_argument("--database", default="training_benchmark",
+                     help="database to drop and seed (default: training_benchmark)")
+    run.add_argument("--drop", action="store_true",
+                     help="confirm dropping --database on the mongod server")
+    run.add_argument("--participants", type=int, default=50000)
+    run.add_argument("--trainings", type=int, default=1000)
+    run.add_argument("--per-training", type=int, default=30,
+                     help="participants assigned to each training")
+    run.add_argument("--days", type=int, default=365,
+                     help="how far back trainings start")
+    run.add_argument("--sessions-per-training", type=int,
+                     help="cap on each training's sessions (default: every "
+                          "training day from its start up to today)")
+    run.add_argument("--attendance-rate", type=float, default=0.85)
+    run.add_argument("--upload-rows", type=int, default=5000,
+                     help="rows in each Bulk Upload file")
+    run.add_argument("--repeat", type=int, default=10)
+    run.add_argument("--seed", type=int, default=42)
+    run.add_argument("--output", help="results file (default: benchmark-<commit>-<backend>.json)")
+    run.add_argument("--keep", action="store_true",
+                     help="keep the seeded database afterwards")
+    run.set_defaults(func=cmd_run)
+
+    compare = subparsers.add_parser("compare", help="show the median change between two runs")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.set_defaults(func=cmd_compare)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
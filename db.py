@@ -0,0 +1,140 @@
+import os
+import threading
+
+from gridfs import GridFSBucket
+from pymongo import MongoClient
+
+import monitoring
+
+# Read MongoDB settings from environment variables
+MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017/")
+MONGODB_DB_NAME = os.getenv("MONGODB_DB_NAME", "training_db")
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "50"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000"))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000"))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "30000"))
+
+# --- SHARED CLIENT ---
+# Streamlit re-executes app.py on every widget interaction, but imported
+# modules stay loaded for the life of the server process. Keeping the client
+# here gives every rerun and every session one shared connection pool.
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide MongoClient, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    MONGODB_URL,
+                    maxPoolSize=MONGODB_MAX_POOL_SIZE,
+                    minPoolSize=MONGODB_MIN_POOL_SIZE,
+                    maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS,
+                    connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+                    socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS,
+                    appname="training_attendance_management",
+                    event_listeners=(
+                        [monitoring.command_listener]
+                        if monitoring.MONITORING_ENABLED else []),
+                )
+    return _client
+
+
+def close_client():
+    """Close the shared client so the next call to get_client() reconnects."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def set_client(client):
+    """Use client as the shared client, e.g. an in-memory stand-in for benchmarks."""
+    global _client
+    with _client_lock:
+        if _client is not None and _client is not client:
+            _client.close()
+        _client = client
+
+
+def get_db():
+    return get_client()[MONGODB_DB_NAME]
+
+
+# --- COLLECTIONS ---
+
+
+def users_collection():
+    return get_db()["users"]
+
+
+def trainings_collection():
+    return get_db()["trainings"]
+
+
+def participants_collection():
+    return get_db()["participants"]
+
+
+def attendance_collection():
+    return get_db()["attendance"]
+
+
+def removals_collection():
+    return get_db()["removals"]
+
+
+def rollups_collection():
+    return get_db()["attendance_rollups"]
+
+
+def holidays_collection():
+    return get_db()["holidays"]
+
+
+def jobs_collection():
+    return get_db()["jobs"]
+
+
+def job_files():
+    """GridFS bucket holding files produced by background jobs."""
+    return GridFSBucket(get_db(), bucket_name="job_files")
+
+
+# --- TRANSACTIONS ---
+
+TRANSACTION_TOPOLOGIES = ("ReplicaSetWithPrimary", "Sharded", "LoadBalanced")
+
+
+def supports_transactions():
+    """True when connected to a deployment that supports multi-document transactions."""
+    client = get_client()
+    description = getattr(client, "topology_description", None)
+    if description is None:
+        return False
+    if description.topology_type_name == "Unknown":
+        # Nothing has connected yet; one round trip discovers the topology
+        client.admin.command("ping")
+        description = client.topology_description
+    return description.topology_type_name in TRANSACTION_TOPOLOGIES
+
+
+def run_in_transaction(callback):
+    """Run callback(session) in a transaction, or callback(None) on a standalone server.
+
+    The callback may be retried on transient transaction errors, so it must
+    only perform database writes.
+    """
+    if not supports_transactions():
+        return callback(None)
+    with get_client().start_session() as session:
+        return session.with_transaction(callback)
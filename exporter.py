@@ -0,0 +1,210 @@
+"""Streaming attendance exports to CSV, XLSX and Parquet.
+
+CSV and Parquet get one row per mark (training, date, topic, participant,
+status) so any number of trainings share one schema. XLSX gets one sheet per
+training laid out like training_status.xlsx: participants down the side,
+one "date\\n(topic)" column per session and "P"/"A" cells, blank where the
+participant was not marked.
+
+Sessions are read through batched cursors and written as they arrive, so
+memory is bounded by one batch (or, for XLSX, one training's matrix) rather
+than the whole history.
+"""
+import io
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+
+import attendance
+import repository
+
+# Sessions fetched per cursor round trip and written per CSV/Parquet batch
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+LONG_COLUMNS = ["Training", "Trainer", "Date", "Topic", "Participant", "Email", "Status"]
+
+# Characters Excel does not allow in sheet names, which are capped at 31
+SHEET_TITLE_INVALID = re.compile(r"[\[\]:*?/\\]")
+SHEET_TITLE_MAX_LENGTH = 31
+
+
+# --- READING ---
+
+
+def session_batches(trainings, start_date=None, end_date=None,
+                    batch_size=EXPORT_BATCH_SIZE):
+    """Yield lists of up to batch_size (training, session) pairs across trainings."""
+    batch = []
+    for training in trainings:
+        sessions = repository.session_cursor(
+            training["_id"], start_date, end_date, batch_size)
+        for session in sessions:
+            batch.append((training, session))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def long_frame(batch):
+    """One row per mark for a batch of (training, session) pairs."""
+    counts = [len(session.get("participant_ids", [])) for _, session in batch]
+    participant_ids = [
+        pid for _, session in batch for pid in session.get("participant_ids", [])]
+    present = np.array(
+        [p for _, session in batch for p in session.get("present", [])], dtype=bool)
+
+    contacts = repository.participant_contacts(set(participant_ids))
+    labels = [contacts.get(pid, ("", "")) for pid in participant_ids]
+
+    def repeat(values):
+        return np.repeat(np.array(values, dtype=object), counts)
+
+    return pd.DataFrame({
+        "Training": repeat([t.get("training_name", "") for t, _ in batch]),
+        "Trainer": repeat([t.get("trainer_name", "") for t, _ in batch]),
+        "Date": repeat([s["date"] for _, s in batch]),
+        "Topic": repeat([s.get("topic", "") for _, s in batch]),
+        "Participant": [name for name, _ in labels],
+        "Email": [email for _, email in labels],
+        "Status": np.where(present, "P", "A"),
+    }, columns=LONG_COLUMNS)
+
+
+# --- WRITERS ---
+
+
+def _write_csv(out, batches, progress):
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+    sessions = 0
+    try:
+        pd.DataFrame(columns=LONG_COLUMNS).to_csv(text, index=False)
+        for batch in batches:
+            long_frame(batch).to_csv(text, index=False, header=False)
+            sessions += len(batch)
+            if progress is not None:
+                progress(sessions)
+        text.flush()
+    finally:
+        # Leave the caller's file open
+        text.detach()
+    return sessions
+
+
+def _write_parquet(out, batches, progress):
+    schema = pa.schema([(column, pa.string()) for column in LONG_COLUMNS])
+    sessions = 0
+    # Every batch becomes one row group, so the writer never holds more than one
+    with pq.ParquetWriter(out, schema) as writer:
+        for batch in batches:
+            writer.write_table(pa.Table.from_pandas(
+                long_frame(batch), schema=schema, preserve_index=False))
+            sessions += len(batch)
+            if progress is not None:
+                progress(sessions)
+    return sessions
+
+
+def sheet_title(name, used):
+    """A valid, unused Excel sheet title for a training name."""
+    base = SHEET_TITLE_INVALID.sub("_", name or "").strip() or "Training"
+    title = base[:SHEET_TITLE_MAX_LENGTH]
+    copy = 1
+    while title.lower() in used:
+        copy += 1
+        suffix = f" ({copy})"
+        title = base[:SHEET_TITLE_MAX_LENGTH - len(suffix)] + suffix
+    used.add(title.lower())
+    return title
+
+
+def matrix_rows(training, sessions):
+    """(header, rows) of a training's participant x session "P"/"A" sheet.
+
+    Participants on the training and anyone marked in the sessions get a
+    row, sorted by name; cells are None where a participant was not marked.
+    """
+    header = ["Participant Name"] + [
+        attendance.column_label(s["date"], s.get("topic", "")) for s in sessions]
+
+    counts = [len(s.get("participant_ids", [])) for s in sessions]
+    marked = [pid for s in sessions for pid in s.get("participant_ids", [])]
+    present = np.array(
+        [p for s in sessions for p in s.get("present", [])], dtype=bool)
+    participants = pd.Index(list(training.get("participant_ids", [])) + marked).unique()
+
+    cells = np.full((len(participants), len(sessions)), None, dtype=object)
+    cells[participants.get_indexer(marked), np.repeat(np.arange(len(sessions)), counts)] = \
+        np.where(present, "P", "A")
+
+    contacts = repository.participant_contacts(participants)
+    names = [contacts.get(pid, ("", ""))[0] for pid in participants]
+    order = sorted(range(len(participants)), key=names.__getitem__)
+    return header, ([names[i]] + cells[i].tolist() for i in order)
+
+
+def _write_xlsx(out, trainings, start_date, end_date, batch_size, progress):
+    # write_only streams rows to disk as they are appended instead of
+    # keeping every cell object in memory
+    workbook = Workbook(write_only=True)
+    used_titles = set()
+    sessions_written = 0
+
+    for training in trainings:
+        sessions = list(repository.session_cursor(
+            training["_id"], start_date, end_date, batch_size))
+        if not sessions:
+            continue
+        header, rows = matrix_rows(training, sessions)
+        sheet = workbook.create_sheet(
+            sheet_title(training.get("training_name"), used_titles))
+        sheet.append(header)
+        for row in rows:
+            sheet.append(row)
+        sessions_written += len(sessions)
+        if progress is not None:
+            progress(sessions_written)
+
+    if not used_titles:
+        workbook.create_sheet("Attendance").append(["Participant Name"])
+    workbook.save(out)
+    return sessions_written
+
+
+# --- EXPORT ---
+
+
+def export_attendance(out, file_format, training_ids=None, start_date=None,
+                      end_date=None, batch_size=EXPORT_BATCH_SIZE, progress=None):
+    """Write attendance for the given trainings (all if None) to a binary file.
+
+    start_date and end_date are inclusive "YYYY-MM-DD" bounds; either may be
+    None. progress, if given, is called with the number of sessions written
+    so far. Returns the number of sessions exported.
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Unsupported export format {file_format!r}; "
+            f"choose one of {', '.join(EXPORT_FORMATS)}.")
+
+    trainings = repository.export_trainings(training_ids)
+    if file_format == "xlsx":
+        return _write_xlsx(
+            out, trainings, start_date, end_date, batch_size, progress)
+
+    batches = session_batches(trainings, start_date, end_date, batch_size)
+    if file_format == "csv":
+        return _write_csv(out, batches, progress)
+    return _write_parquet(out, batches, progress)
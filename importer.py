@@ -0,0 +1,357 @@
+"""Streaming imports from uploaded CSV/XLSX files.
+
+Files are read a chunk at a time so a 20k-row HR export never has to be held
+as a single DataFrame, and every chunk is written with one bulk request.
+"""
+import os
+import re
+
+import pandas as pd
+from openpyxl import load_workbook
+
+import attendance
+import repository
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+
+PARTICIPANT_COLUMNS = ["participant_name", "email", "phone"]
+
+EMAIL_PATTERN = r"^[^@\s]+@[^@\s]+\.[^@\s]+$"
+
+# Status sheet date headers: "YYYY-MM-DD" or "YYYY-MM-DD\n(topic)". Excel may
+# hand back a date cell as a midnight timestamp.
+STATUS_HEADER = re.compile(
+    r"^(\d{4}-\d{2}-\d{2})(?:[ T]00:00:00)?\s*(?:\((.*)\))?$", re.DOTALL)
+
+
+# --- READING ---
+
+
+def _csv_chunks(file, chunk_size):
+    reader = pd.read_csv(
+        file, dtype=str, keep_default_na=False, chunksize=chunk_size)
+    for chunk in reader:
+        yield chunk
+
+
+def _xlsx_chunks(file, chunk_size):
+    # read_only streams rows from the sheet XML instead of building the
+    # whole workbook in memory
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = ["" if h is None else str(h) for h in header]
+
+        batch = []
+        for row in rows:
+            batch.append(["" if v is None else str(v) for v in row])
+            if len(batch) == chunk_size:
+                yield pd.DataFrame(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns)
+    finally:
+        workbook.close()
+
+
+def read_chunks(file, chunk_size=IMPORT_CHUNK_SIZE):
+    """Yield DataFrame chunks of string cells from an uploaded CSV or XLSX file.
+
+    Each chunk keeps its position in the file as the index, starting at 0 for
+    the first data row.
+    """
+    if file.name.endswith(".csv"):
+        chunks = _csv_chunks(file, chunk_size)
+    elif file.name.endswith(".xlsx"):
+        chunks = _xlsx_chunks(file, chunk_size)
+    else:
+        raise ValueError("Only .csv and .xlsx files are supported.")
+
+    offset = 0
+    for chunk in chunks:
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
+
+
+def estimate_rows(file):
+    """Rough data-row count used to drive the progress bar, or None if unknown."""
+    if file.name.endswith(".csv"):
+        data = file.getvalue()
+        return max(data.count(b"\n") - 1 + (not data.endswith(b"\n")), 0)
+    if file.name.endswith(".xlsx"):
+        workbook = load_workbook(file, read_only=True)
+        try:
+            max_row = workbook.active.max_row
+        finally:
+            workbook.close()
+            file.seek(0)
+        return max_row - 1 if max_row else None
+    return None
+
+
+# --- PARTICIPANTS ---
+
+
+def normalize_participants(chunk):
+    """Clean a chunk of participant rows.
+
+    Returns (valid, errors): a DataFrame of rows ready to write and a list of
+    {"row", "error"} dicts, where row is the spreadsheet row number (header
+    is row 1).
+    """
+    chunk = chunk.rename(columns=lambda c: str(c).strip().lower())
+    missing = [c for c in PARTICIPANT_COLUMNS if c not in chunk.columns]
+    if missing:
+        raise ValueError(
+            "The file must contain 'participant_name', 'email', and 'phone' columns.")
+
+    df = chunk[PARTICIPANT_COLUMNS].apply(lambda col: col.str.strip())
+    df["email"] = df["email"].str.lower()
+    # Spreadsheets often turn phone numbers into floats ("3001234567.0")
+    df["phone"] = df["phone"].str.replace(r"\.0$", "", regex=True)
+
+    problems = pd.Series("", index=df.index)
+    problems = problems.mask(df["phone"] == "", "missing phone")
+    problems = problems.mask(
+        ~df["email"].str.match(EMAIL_PATTERN), "invalid email")
+    problems = problems.mask(df["email"] == "", "missing email")
+    problems = problems.mask(df["participant_name"] == "", "missing participant_name")
+
+    bad = problems != ""
+    errors = [
+        {"row": index + 2, "error": message}
+        for index, message in problems[bad].items()
+    ]
+    return df[~bad], errors
+
+
+def import_participants(file, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    """Upsert participants from an uploaded file, keyed on email.
+
+    Rows are validated per chunk and written with one unordered bulk_write
+    per chunk. A repeated email inside the file keeps its last row. progress,
+    if given, is called with the number of rows read so far after each chunk.
+
+    Returns a dict with the counts of rows read, inserted and updated, and the
+    per-row errors.
+    """
+    result = {"rows": 0, "inserted": 0, "updated": 0, "errors": []}
+    seen = {}
+
+    for chunk in read_chunks(file, chunk_size):
+        valid, errors = normalize_participants(chunk)
+        result["rows"] += len(chunk)
+        result["errors"].extend(errors)
+
+        repeated = valid["email"].duplicated(keep="last")
+        for index, email in valid.loc[repeated, "email"].items():
+            result["errors"].append(
+                {"row": index + 2, "error": f"duplicate email {email}, later row kept"})
+        valid = valid[~repeated]
+
+        for index, email in valid["email"].items():
+            if email in seen:
+                result["errors"].append(
+                    {"row": seen[email], "error": f"duplicate email {email}, later row kept"})
+            seen[email] = index + 2
+
+        if not valid.empty:
+            rows = [index + 2 for index in valid.index]
+            write = repository.upsert_participants(valid.to_dict("records"))
+            result["inserted"] += write["upserted"]
+            result["updated"] += write["modified"]
+            for position, message in write["errors"]:
+                result["errors"].append({"row": rows[position], "error": message})
+
+        if progress is not None:
+            progress(result["rows"])
+
+    result["errors"].sort(key=lambda e: e["row"])
+    return result
+
+
+# --- ATTENDANCE ---
+
+
+def _status_columns(columns):
+    """Map a status sheet's date columns to dates and topics.
+
+    Returns (dates, topics, errors): {column: date}, {date: topic} and a
+    {"row", "error"} dict for every header that is not a date.
+    """
+    dates, topics, errors = {}, {}, []
+    for column in columns[1:]:
+        header = column.strip()
+        if not header or header.lower() == "email":
+            continue
+        match = STATUS_HEADER.match(header)
+        if match is None:
+            errors.append({"row": 1, "error": f"column {header!r} is not a date"})
+        elif match.group(1) in topics:
+            errors.append({"row": 1, "error": f"date {match.group(1)} appears twice"})
+        else:
+            dates[column] = match.group(1)
+            topics[match.group(1)] = (match.group(2) or "").strip()
+    return dates, topics, errors
+
+
+def parse_status_sheet(file, chunk_size=IMPORT_CHUNK_SIZE):
+    """Read a participant x date sheet laid out like training_status.xlsx.
+
+    The first column holds participant names and an optional "Email" column
+    tells apart participants who share a name. Every other column is a date
+    header with "P"/"A" cells; blank cells are left unmarked.
+
+    Returns (marks, topics, errors): a DataFrame with row, participant,
+    email, date and present for every marked cell, {date: topic} for every
+    date column, and {"row", "error"} dicts for anything that was skipped.
+    """
+    frames, dates, topics, errors = [], None, {}, []
+
+    for chunk in read_chunks(file, chunk_size):
+        if dates is None:
+            dates, topics, errors = _status_columns(list(chunk.columns))
+        email_column = next(
+            (c for c in chunk.columns if c.strip().lower() == "email"), None)
+
+        cells = chunk[list(dates)].apply(lambda col: col.str.strip().str.upper())
+        cells = cells.stack()
+        cells = cells[cells != ""]
+
+        invalid = ~cells.isin(["P", "A"])
+        for (index, column), value in cells[invalid].items():
+            errors.append({"row": index + 2,
+                           "error": f"mark {value!r} on {dates[column]} is not P or A"})
+        cells = cells[~invalid]
+
+        rows = cells.index.get_level_values(0)
+        names = chunk.iloc[:, 0].str.strip()
+        emails = (chunk[email_column].str.strip().str.lower()
+                  if email_column else pd.Series("", index=chunk.index))
+        frames.append(pd.DataFrame({
+            "row": rows + 2,
+            "participant": names.loc[rows].to_numpy(),
+            "email": emails.loc[rows].to_numpy(),
+            "date": cells.index.get_level_values(1).map(dates),
+            "present": (cells == "P").to_numpy(),
+        }))
+
+    columns = ["row", "participant", "email", "date", "present"]
+    marks = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+    return marks, topics, errors
+
+
+def _match_participants(training_id, marks):
+    """Participant _id for each mark, matched by email or else by name.
+
+    Participants removed from the training still match so old sessions can be
+    back-filled. Returns (participant_ids, errors) with None for no match.
+    """
+    candidates = {
+        p["_id"]: (p["participant_name"], p.get("email", ""))
+        for p in repository.training_participants(training_id)
+    }
+    candidates.update(repository.participant_contacts(
+        repository.removed_participant_ids(training_id) - set(candidates)))
+
+    by_email = {email.lower(): pid for pid, (_, email) in candidates.items() if email}
+    by_name = {}
+    for pid, (name, _) in candidates.items():
+        by_name.setdefault(name.strip().lower(), []).append(pid)
+
+    matched, errors = {}, []
+    for row, name, email in marks[["row", "participant", "email"]].drop_duplicates(
+            "row").itertuples(index=False):
+        if email:
+            pid = by_email.get(email)
+            problem = None if pid else f"no participant with email {email} on this training"
+        else:
+            pids = by_name.get(name.lower(), [])
+            pid = pids[0] if len(pids) == 1 else None
+            if not name:
+                problem = "missing participant name"
+            elif not pids:
+                problem = f"no participant named {name} on this training"
+            elif pid is None:
+                problem = f"more than one participant is named {name}; add an Email column"
+            else:
+                problem = None
+        matched[row] = pid
+        if problem:
+            errors.append({"row": row, "error": problem})
+
+    return marks["row"].map(matched), errors
+
+
+def plan_attendance_import(training_id, file, chunk_size=IMPORT_CHUNK_SIZE):
+    """Diff a status sheet against the training's saved attendance.
+
+    Sheet marks override saved marks for the same participant and date;
+    saved marks the sheet leaves blank are kept, as is a saved topic when
+    the sheet's header has none.
+
+    Returns a dict with "sessions" (only the new or changed ones, ready for
+    apply_attendance_import), a "summary" DataFrame with one row per date,
+    and per-row "errors".
+    """
+    marks, topics, errors = parse_status_sheet(file, chunk_size)
+    participant_ids, match_errors = _match_participants(training_id, marks)
+    errors.extend(match_errors)
+
+    marks = marks.assign(participant_id=participant_ids)
+    marks = marks[marks["participant_id"].notna()]
+    repeated = marks.duplicated(["participant_id", "date"], keep="last")
+    for row in marks.loc[repeated, "row"].unique():
+        errors.append({"row": int(row), "error": "participant appears twice, later row kept"})
+    marks = marks[~repeated]
+
+    saved = repository.saved_attendance(training_id, list(topics))
+    by_date = {date: group for date, group in marks.groupby("date")}
+    sessions, summary = [], []
+
+    for date in sorted(topics):
+        saved_topic, saved_marks = saved.get(date, (None, {}))
+        group = by_date.get(date)
+        updates = (dict(zip(group["participant_id"], group["present"].tolist()))
+                   if group is not None else {})
+        if saved_topic is None and not updates:
+            continue
+
+        topic = topics[date] or saved_topic or ""
+        changed = sum(saved_marks.get(pid) != present for pid, present in updates.items())
+        if saved_topic is None:
+            change = "new"
+        elif changed or topic != saved_topic:
+            change = "updated"
+        else:
+            change = "unchanged"
+
+        summary.append({"Date": date, "Topic": topic, "Change": change,
+                        "Marks Changed": changed})
+        if change != "unchanged":
+            sessions.append({"date": date, "topic": topic,
+                             "attendance": {**saved_marks, **updates}})
+
+    errors.sort(key=lambda e: e["row"])
+    return {
+        "sessions": sessions,
+        "summary": pd.DataFrame(
+            summary, columns=["Date", "Topic", "Change", "Marks Changed"]),
+        "errors": errors,
+    }
+
+
+def apply_attendance_import(training_id, sessions, chunk_size=IMPORT_CHUNK_SIZE,
+                            progress=None):
+    """Save planned sessions in bulk writes of up to chunk_size sessions.
+
+    progress, if given, is called with the number of sessions saved so far.
+    """
+    for start in range(0, len(sessions), chunk_size):
+        attendance.save_sessions(training_id, sessions[start:start + chunk_size])
+        if progress is not None:
+            progress(min(start + chunk_size, len(sessions)))
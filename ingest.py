@@ -0,0 +1,416 @@
+"""Headless check-in ingestion for card readers and other integrations.
+
+Usage:
+    python ingest.py serve [--host HOST] [--port PORT]
+                            accept POST /checkins over HTTP (needs INGEST_TOKEN)
+    python ingest.py load FILE
+                            ingest JSON-lines events from FILE, or - for stdin
+
+An event is a JSON object such as
+
+    {"training_id": "<hex _id>", "email": "ali@example.com",
+     "timestamp": "2025-03-19T09:02:11"}
+
+naming the training by training_id or training_name, the participant by
+participant_id or email, and the session by date ("YYYY-MM-DD") or
+timestamp. present, if given, must be true or false; it defaults to true. Over HTTP, POST a JSON list of events
+(or {"events": [...]}) with "Authorization: Bearer <INGEST_TOKEN>".
+
+Events are buffered and coalesced per (training, date), so a burst of
+check-ins for one session becomes a single document write. Every flush
+merges the buffered marks into the saved sessions with one bulk upsert,
+which only replaces a session nobody has saved since it was read. A
+session created by check-ins marks everyone else on the training absent.
+A flush that fails keeps its marks buffered and is retried. Rollups of
+sessions that already existed are rebuilt when next read, not per flush.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+import attendance
+import migrations
+import monitoring
+import repository
+import rollups
+
+logger = logging.getLogger(__name__)
+
+# Shared secret devices send as a bearer token; the server refuses to start without it
+INGEST_TOKEN = os.getenv("INGEST_TOKEN", "")
+
+# Buffered events are written at least this often...
+INGEST_FLUSH_SECONDS = float(os.getenv("INGEST_FLUSH_SECONDS", "1.0"))
+
+# ...or as soon as this many are waiting
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "5000"))
+
+# Largest request body the HTTP endpoint accepts
+INGEST_MAX_BODY_BYTES = 10 * 1024 * 1024
+
+# Times a flush re-reads and re-merges sessions saved by someone else meanwhile
+INGEST_MERGE_ATTEMPTS = 5
+
+# Times the final flush is retried on shutdown before giving up
+INGEST_STOP_ATTEMPTS = int(os.getenv("INGEST_STOP_ATTEMPTS", "5"))
+
+
+# --- EVENTS ---
+
+
+def _object_id(value):
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+def _event_date(event):
+    value = event.get("date") or event.get("timestamp")
+    try:
+        return datetime.fromisoformat(str(value)).strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def resolve_events(events):
+    """Turn raw events into (training_id, date, participant_id, present) marks.
+
+    Emails are looked up with one query per call and training names from the
+    read cache. Returns (marks, errors) where errors are {"index", "error"}
+    dicts for events that were rejected.
+    """
+    trainings_by_name = {
+        name: training_id for training_id, name in repository.training_choices().items()}
+    enrolled = {}
+    emails = {
+        str(e["email"]).strip().lower() for e in events
+        if isinstance(e, dict) and e.get("email") and not e.get("participant_id")
+    }
+    participants_by_email = repository.participant_ids_by_email(emails) if emails else {}
+
+    marks, errors = [], []
+    for index, event in enumerate(events):
+        if not isinstance(event, dict):
+            errors.append({"index": index, "error": "event is not an object"})
+            continue
+
+        if event.get("training_id"):
+            training_id = _object_id(event["training_id"])
+        else:
+            training_id = trainings_by_name.get(event.get("training_name"))
+        if training_id is not None and training_id not in enrolled:
+            training = repository.get_training(training_id)
+            enrolled[training_id] = (
+                set(training.get("participant_ids", [])) if training else None)
+
+        if event.get("participant_id"):
+            participant_id = _object_id(event["participant_id"])
+        else:
+            participant_id = participants_by_email.get(
+                str(event.get("email") or "").strip().lower())
+
+        date = _event_date(event)
+        present = event.get("present", True)
+        if enrolled.get(training_id) is None:
+            errors.append({"index": index, "error": "unknown training"})
+        elif participant_id not in enrolled[training_id]:
+            errors.append({"index": index, "error": "participant is not on this training"})
+        elif date is None:
+            errors.append({"index": index, "error": "missing or invalid date/timestamp"})
+        elif not isinstance(present, bool):
+            errors.append({"index": index, "error": "present must be true or false"})
+        else:
+            marks.append((training_id, date, participant_id, present))
+    return marks, errors
+
+
+# --- BUFFER ---
+
+
+class CheckinBuffer:
+    """Coalesces marks per (training, date) and writes them in bulk.
+
+    A background thread flushes every INGEST_FLUSH_SECONDS, or sooner once
+    INGEST_MAX_PENDING events are waiting. Later events for the same
+    participant and session win. Accepted events are never dropped: a
+    failed flush puts its marks back and the next flush retries them.
+    """
+
+    def __init__(self, flush_seconds=INGEST_FLUSH_SECONDS, max_pending=INGEST_MAX_PENDING):
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._pending = {}
+        self._pending_events = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.stats = {"events": 0, "rejected": 0, "flushes": 0, "sessions_written": 0,
+                      "failed_flushes": 0}
+
+    def add(self, events):
+        """Buffer a batch of raw events. Returns (accepted, errors)."""
+        marks, errors = resolve_events(events)
+        with self._lock:
+            for training_id, date, participant_id, present in marks:
+                self._pending.setdefault((training_id, date), {})[participant_id] = present
+            self._pending_events += len(marks)
+            self.stats["events"] += len(marks)
+            self.stats["rejected"] += len(errors)
+            full = self._pending_events >= self.max_pending
+        if full:
+            if self._thread is None:
+                self._try_flush()
+            else:
+                self._wake.set()
+        return len(marks), errors
+
+    def flush(self):
+        """Write everything buffered so far. Returns the number of sessions written.
+
+        If the write fails the marks go back into the buffer, behind any that
+        arrived meanwhile, and the error is raised.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                pending_events, self._pending_events = self._pending_events, 0
+            if not pending:
+                return 0
+            try:
+                with monitoring.measure("ingest: flush"):
+                    written = self._write(pending)
+            except Exception:
+                self._restore(pending, pending_events)
+                raise
+            self.stats["flushes"] += 1
+            self.stats["sessions_written"] += written
+            return written
+
+    def _restore(self, pending, pending_events):
+        with self._lock:
+            for key, marks in pending.items():
+                # Marks buffered since the flush began are newer and win
+                self._pending[key] = {**marks, **self._pending.get(key, {})}
+            self._pending_events += pending_events
+            self.stats["failed_flushes"] += 1
+
+    def _try_flush(self):
+        try:
+            self.flush()
+            return True
+        except Exception:
+            logger.exception("Check-in flush failed; the marks stay buffered for a retry")
+            return False
+
+    def _merge(self, pending):
+        """Merge buffered marks into the saved sessions.
+
+        Returns (records, expected): the records to write, and what each
+        session held when read, for save_attendance() to check.
+        """
+        by_training = {}
+        for (training_id, date), marks in pending.items():
+            by_training.setdefault(training_id, {})[date] = marks
+
+        records, expected = [], {}
+        for training_id, sessions in by_training.items():
+            saved = repository.saved_attendance(training_id, list(sessions))
+            enrolled = (repository.get_training(training_id) or {}).get("participant_ids", [])
+            for date, marks in sessions.items():
+                if date in saved:
+                    topic, merged = saved[date][0], dict(saved[date][1])
+                    expected[training_id, date] = (list(merged), list(merged.values()))
+                else:
+                    topic, merged = "", dict.fromkeys(enrolled, False)
+                    expected[training_id, date] = None
+                merged.update(marks)
+                records.append(attendance.compact_record(training_id, date, topic, merged))
+        return records, expected
+
+    def _write(self, pending):
+        # One unordered bulk upsert for every session touched since the last
+        # flush. Re-saving a session marks its rollup stale rather than
+        # re-aggregating the training's history on every flush.
+        for attempt in range(1, INGEST_MERGE_ATTEMPTS + 1):
+            records, expected = self._merge(pending)
+            try:
+                rollups.save_sessions(records, rebuild_stale=False, expected=expected)
+                return len(records)
+            except repository.AttendanceConflict:
+                if attempt == INGEST_MERGE_ATTEMPTS:
+                    raise
+                logger.info("Sessions were saved during a check-in flush; merging again")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self._try_flush()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="ingest-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self, attempts=INGEST_STOP_ATTEMPTS):
+        """Stop the flusher and write everything buffered.
+
+        A failed final flush is retried up to attempts times in all. Returns
+        False if marks were still left unwritten.
+        """
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(self.flush_seconds)
+            if self._try_flush():
+                return True
+        logger.error("Gave up on %d buffered check-ins after %d failed flushes",
+                     self._pending_events, attempts)
+        return False
+
+
+# --- HTTP ---
+
+
+def make_handler(buffer):
+    class CheckinHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, {"status": "ok", **buffer.stats})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/checkins":
+                return self._reply(404, {"error": "not found"})
+            if self.headers.get("Authorization") != f"Bearer {INGEST_TOKEN}":
+                return self._reply(401, {"error": "invalid token"})
+
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > INGEST_MAX_BODY_BYTES:
+                return self._reply(413, {"error": "request body too large"})
+            try:
+                body = json.loads(self.rfile.read(length) or b"null")
+            except ValueError:
+                return self._reply(400, {"error": "body is not valid JSON"})
+            events = body.get("events") if isinstance(body, dict) else body
+            if not isinstance(events, list):
+                return self._reply(400, {"error": "expected a list of events"})
+
+            accepted, errors = buffer.add(events)
+            self._reply(202, {"accepted": accepted, "errors": errors})
+
+        def log_message(self, format, *args):
+            logger.debug("%s %s", self.address_string(), format % args)
+
+    return CheckinHandler
+
+
+def cmd_serve(args):
+    if not INGEST_TOKEN:
+        print("Set INGEST_TOKEN to the token devices will send.")
+        return 1
+    migrations.bootstrap()
+    buffer = CheckinBuffer()
+    buffer.start()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(buffer))
+    print(f"Accepting check-ins on http://{args.host}:{args.port}/checkins")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        written = buffer.stop()
+    return 0 if written else 1
+
+
+# --- CLI ---
+
+
+def cmd_load(args):
+    migrations.bootstrap()
+    buffer = CheckinBuffer()
+    accepted, rejected = 0, 0
+    batch, line_numbers = [], []
+
+    def add_batch():
+        nonlocal accepted, rejected
+        added, errors = buffer.add(batch)
+        accepted += added
+        rejected += len(errors)
+        for error in errors:
+            print(f"Line {line_numbers[error['index']]}: {error['error']}", file=sys.stderr)
+        batch.clear()
+        line_numbers.clear()
+
+    source = sys.stdin if args.file == "-" else open(args.file)
+    with source:
+        for line_number, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            try:
+                batch.append(json.loads(line))
+            except ValueError:
+                batch.append(None)
+            line_numbers.append(line_number)
+            if len(batch) == args.batch_size:
+                add_batch()
+        if batch:
+            add_batch()
+    if not buffer.stop():
+        print("Some check-ins could not be written; see the log and load the file again.",
+              file=sys.stderr)
+        return 1
+
+    print(f"Ingested {accepted} events into {buffer.stats['sessions_written']} "
+          f"session writes; {rejected} rejected.")
+    return 1 if rejected else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve = subparsers.add_parser("serve", help="accept POST /checkins over HTTP")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8502)
+    serve.set_defaults(func=cmd_serve)
+
+    load = subparsers.add_parser("load", help="ingest JSON-lines events from a file")
+    load.add_argument("file", help="events file, or - for stdin")
+    load.add_argument("--batch-size", type=int, default=1000)
+    load.set_defaults(func=cmd_load)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""Background jobs for imports, exports and rollup rebuilds.
+
+Jobs run on a process-wide thread pool, so they keep going when the page
+that started them reruns or the user navigates away. Each job has a record
+in the "jobs" collection holding its status, progress and result, which any
+page can poll. JOB_WORKERS bounds how many jobs run at once; the rest wait
+in the pool's queue, so heavy jobs hold at most that many pooled MongoDB
+connections and interactive pages keep the rest.
+"""
+import io
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import exporter
+import importer
+import monitoring
+import repository
+import rollups
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+# Progress is written to MongoDB at most this often per job
+JOB_PROGRESS_INTERVAL_SECONDS = 1.0
+
+# Every server process refreshes the heartbeat of its queued and running jobs
+# this often, so they stay fresh even while waiting for a worker
+JOB_HEARTBEAT_SECONDS = 30
+
+# A queued or running job whose heartbeat is older than this is assumed to
+# have died with its server process
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "600"))
+
+# Finished jobs and their files are deleted after this many days
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+
+# Per-row errors kept in a job result, so one bad file cannot outgrow a document
+JOB_MAX_ERRORS = 1000
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# Unique per process: in a container the hostname and pid repeat on restart
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+
+# --- RUNNER ---
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _heartbeat():
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+        try:
+            repository.touch_jobs(ACTIVE_STATUSES, WORKER_ID, datetime.now())
+        except Exception:
+            logger.exception("Job heartbeat failed")
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=JOB_WORKERS, thread_name_prefix="job")
+                threading.Thread(
+                    target=_heartbeat, name="job-heartbeat", daemon=True).start()
+    return _executor
+
+
+def submit(kind, label, func, owner=None, total=None):
+    """Queue func(progress) to run in the background and return the job _id.
+
+    func must return a BSON-friendly dict, stored as the job's result.
+    progress(done) records how many of total units are finished.
+    """
+    now = datetime.now()
+    repository.delete_jobs_before(now - timedelta(days=JOB_RETENTION_DAYS))
+    job_id = repository.create_job({
+        "kind": kind,
+        "label": label,
+        "owner": owner,
+        "worker": WORKER_ID,
+        "status": "queued",
+        "created_at": now,
+        "heartbeat": now,
+        "started_at": None,
+        "finished_at": None,
+        "progress": {"done": 0, "total": total},
+        "result": None,
+        "error": None,
+    })
+    _get_executor().submit(_run, job_id, kind, func)
+    return job_id
+
+
+def _run(job_id, kind, func):
+    started = datetime.now()
+    repository.update_job(
+        job_id, {"status": "running", "started_at": started, "heartbeat": started})
+    last_report = 0.0
+
+    def progress(done):
+        nonlocal last_report
+        if time.monotonic() - last_report >= JOB_PROGRESS_INTERVAL_SECONDS:
+            last_report = time.monotonic()
+            repository.update_job(
+                job_id, {"progress.done": done, "heartbeat": datetime.now()})
+
+    try:
+        with monitoring.measure(f"job: {kind}"):
+            result = func(progress)
+    except Exception as e:
+        logger.exception("Job %s failed", job_id)
+        repository.update_job(job_id, {
+            "status": "failed", "error": str(e), "finished_at": datetime.now()})
+    else:
+        repository.update_job(job_id, {
+            "status": "succeeded", "result": result, "finished_at": datetime.now()})
+
+
+def get(job_id):
+    """A job, first marked interrupted if it is active but its heartbeat stopped."""
+    job = repository.get_job(job_id)
+    now = datetime.now()
+    stale_before = now - timedelta(seconds=JOB_STALE_SECONDS)
+    if (job is not None and job["status"] in ACTIVE_STATUSES
+            and job["heartbeat"] < stale_before):
+        repository.interrupt_stale_jobs(ACTIVE_STATUSES, stale_before, now, job_id)
+        job = repository.get_job(job_id)
+    return job
+
+
+def recent(owner=None, limit=20):
+    """Newest jobs, after marking jobs orphaned by a dead server as interrupted."""
+    now = datetime.now()
+    repository.interrupt_stale_jobs(
+        ACTIVE_STATUSES, now - timedelta(seconds=JOB_STALE_SECONDS), now)
+    return repository.recent_jobs(owner, limit)
+
+
+def job_file(job):
+    """Bytes of the file a finished job produced, or None."""
+    file_id = (job.get("result") or {}).get("file_id")
+    return None if file_id is None else repository.read_job_file(file_id)
+
+
+# --- JOBS ---
+
+
+def import_participants(file, owner=None):
+    """Upsert participants from an uploaded CSV/XLSX file in the background."""
+    # The upload belongs to the session that made it, so the job keeps a copy
+    data = io.BytesIO(file.getvalue())
+    data.name = file.name
+
+    def run(progress):
+        result = importer.import_participants(data, progress=progress)
+        result["error_count"] = len(result["errors"])
+        result["errors"] = result["errors"][:JOB_MAX_ERRORS]
+        return result
+
+    return submit("import_participants", f"Import participants from {file.name}",
+                  run, owner, importer.estimate_rows(data))
+
+
+def apply_attendance_import(training_id, sessions, label, owner=None):
+    """Save the sessions of a planned status sheet import in the background."""
+    def run(progress):
+        importer.apply_attendance_import(training_id, sessions, progress=progress)
+        return {"sessions": len(sessions)}
+
+    return submit("import_attendance", label, run, owner, len(sessions))
+
+
+def export_attendance(file_format, training_ids=None, start_date=None,
+                      end_date=None, owner=None):
+    """Export attendance to a file kept in GridFS until the job is deleted."""
+    file_name = f"attendance.{file_format}"
+
+    def run(progress):
+        # Spool to disk rather than memory, then copy into GridFS in chunks
+        with tempfile.TemporaryFile() as out:
+            sessions = exporter.export_attendance(
+                out, file_format, training_ids, start_date, end_date,
+                progress=progress)
+            out.seek(0)
+            file_id = repository.save_job_file(file_name, out)
+        return {"sessions": sessions, "file_id": file_id, "file_name": file_name,
+                "mime": exporter.EXPORT_FORMATS[file_format]}
+
+    return submit("export_attendance", f"Export {file_name}", run, owner)
+
+
+def rebuild_rollups(owner=None):
+    """Recompute every training's attendance rollup in the background."""
+    def run(progress):
+        return {"trainings": rollups.rebuild(progress=progress)}
+
+    return submit("rebuild_rollups", "Rebuild attendance rollups", run, owner,
+                  len(repository.attendance_training_ids()))
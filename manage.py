@@ -0,0 +1,137 @@
+"""Command line maintenance tasks for the Training Management System.
+
+Usage:
+    python manage.py migrate          apply pending migrations and build indexes
+    python manage.py check-indexes    report indexes that have not been built
+    python manage.py status           list applied and pending migrations
+    python manage.py rebuild-rollups [--training NAME]
+                                      recompute attendance rollups from history
+    python manage.py export FILE [--training NAME ...] [--from DATE] [--to DATE]
+                                      export attendance as .csv, .xlsx or .parquet
+"""
+import argparse
+import os
+import sys
+
+import exporter
+import migrations
+import repository
+import rollups
+
+
+def cmd_migrate(args):
+    try:
+        applied = migrations.migrate()
+    except migrations.IndexBuildError as e:
+        for collection_name, index_name, error in e.failures:
+            print(f"Could not build {collection_name}.{index_name}: {error}")
+        print("Run `python manage.py check-indexes` for the conflicting values.")
+        return 1
+    if applied:
+        print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+    else:
+        print("No pending migrations.")
+    print("Indexes are up to date.")
+    return 0
+
+
+def cmd_check_indexes(args):
+    missing = migrations.missing_indexes()
+    if not missing:
+        print("All indexes exist.")
+        return 0
+    for collection_name, index_name in missing:
+        print(f"Missing index: {collection_name}.{index_name}")
+    for collection_name, index_name, values in migrations.unique_conflicts():
+        print(f"{collection_name}.{index_name} cannot be built until these "
+              f"duplicates are resolved: {', '.join(map(repr, values))}")
+    return 1
+
+
+def cmd_status(args):
+    applied = migrations.applied_versions()
+    for version, description, _ in migrations.MIGRATIONS:
+        state = "applied" if version in applied else "pending"
+        print(f"{version:>4}  {state:<8} {description}")
+    return 0
+
+
+def cmd_rebuild_rollups(args):
+    if args.training:
+        training_id = repository.find_training_id(args.training)
+        if training_id is None:
+            print(f"No training named {args.training}.")
+            return 1
+        rollup = rollups.rebuild(training_id)
+        print(f"Rebuilt rollup for {args.training}: "
+              f"{rollup['sessions_held']} sessions, "
+              f"{len(rollup['participants'])} participants.")
+    else:
+        count = rollups.rebuild()
+        print(f"Rebuilt rollups for {count} trainings.")
+    return 0
+
+
+def cmd_export(args):
+    file_format = os.path.splitext(args.file)[1].lstrip(".").lower()
+    if file_format not in exporter.EXPORT_FORMATS:
+        print(f"Unsupported file type; use one of: "
+              f"{', '.join('.' + f for f in exporter.EXPORT_FORMATS)}.")
+        return 1
+
+    training_ids = None
+    if args.training:
+        training_ids = []
+        for name in args.training:
+            training_id = repository.find_training_id(name)
+            if training_id is None:
+                print(f"No training named {name}.")
+                return 1
+            training_ids.append(training_id)
+
+    with open(args.file, "wb") as out:
+        sessions = exporter.export_attendance(
+            out, file_format, training_ids, args.start_date, args.end_date)
+    print(f"Exported {sessions} sessions to {args.file}.")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser(
+        "migrate", help="apply pending migrations and build indexes"
+    ).set_defaults(func=cmd_migrate)
+    subparsers.add_parser(
+        "check-indexes", help="report indexes that have not been built"
+    ).set_defaults(func=cmd_check_indexes)
+    subparsers.add_parser(
+        "status", help="list applied and pending migrations"
+    ).set_defaults(func=cmd_status)
+
+
+    rebuild = subparsers.add_parser(
+        "rebuild-rollups", help="recompute attendance rollups from history")
+    rebuild.add_argument("--training", help="only rebuild this training")
+    rebuild.set_defaults(func=cmd_rebuild_rollups)
+
+    export = subparsers.add_parser(
+        "export", help="export attendance as .csv, .xlsx or .parquet")
+    export.add_argument("file", help="output file; the extension picks the format")
+    export.add_argument("--training", action="append",
+                        help="only export this training (repeatable)")
+    export.add_argument("--from", dest="start_date", help="first date, YYYY-MM-DD")
+    export.add_argument("--to", dest="end_date", help="last date, YYYY-MM-DD")
+    export.set_defaults(func=cmd_export)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,468 @@
+"""Index bootstrap and versioned schema migrations.
+
+bootstrap() runs once per server process when the app starts; manage.py
+exposes the same steps on the command line.
+"""
+import logging
+import os
+import threading
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, DeleteMany, IndexModel, UpdateOne
+from pymongo.errors import OperationFailure
+
+import db
+import repository
+import rollups
+
+logger = logging.getLogger(__name__)
+
+# Set AUTO_MIGRATE=0 to leave migrations and index builds to manage.py
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "1") == "1"
+
+# Documents rewritten per bulk_write when a migration touches every record
+MIGRATION_BATCH_SIZE = 1000
+
+# --- INDEXES ---
+# Every lookup in repository.py filters on one of these keys.
+
+INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)],
+                   name="username_unique", unique=True),
+    ],
+    "trainings": [
+        IndexModel([("training_name", ASCENDING)], name="training_name"),
+        IndexModel([("participant_ids", ASCENDING)], name="participant_ids"),
+        # (field, _id) pairs back the keyset-paginated View tables
+        IndexModel([("training_name_lower", ASCENDING), ("_id", ASCENDING)],
+                   name="training_name_lower_id"),
+        IndexModel([("trainer_name_lower", ASCENDING), ("_id", ASCENDING)],
+                   name="trainer_name_lower_id"),
+        IndexModel([("start_date", ASCENDING), ("_id", ASCENDING)],
+                   name="start_date_id"),
+    ],
+    "participants": [
+        IndexModel([("participant_name", ASCENDING)], name="participant_name"),
+        IndexModel([("participant_name_lower", ASCENDING), ("_id", ASCENDING)],
+                   name="participant_name_lower_id"),
+        # Also serves Bulk Upload's upserts on email
+        IndexModel([("email", ASCENDING), ("_id", ASCENDING)],
+                   name="email_id"),
+        # Type-ahead search on name words and email
+        IndexModel([("search_keys", ASCENDING)], name="search_keys"),
+    ],
+    "attendance": [
+        IndexModel([("training_id", ASCENDING), ("date", ASCENDING)],
+                   name="training_id_date_unique", unique=True),
+        # Deleting a participant finds every session that marked them
+        IndexModel([("participant_ids", ASCENDING)], name="participant_ids"),
+    ],
+    "removals": [
+        IndexModel([("training_id", ASCENDING), ("removed_on", ASCENDING),
+                    ("_id", ASCENDING)],
+                   name="training_id_removed_on_id"),
+        IndexModel([("participant_id", ASCENDING)], name="participant_id"),
+    ],
+    "holidays": [
+        IndexModel([("date", ASCENDING)], name="date_unique", unique=True),
+    ],
+    "jobs": [
+        # Background Jobs lists a user's newest jobs
+        IndexModel([("owner", ASCENDING), ("created_at", DESCENDING)],
+                   name="owner_created_at"),
+        IndexModel([("status", ASCENDING), ("heartbeat", ASCENDING)],
+                   name="status_heartbeat"),
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+    ],
+}
+
+
+def _index_keys(index_document):
+    return tuple((field, direction) for field, direction in index_document["key"].items())
+
+
+def missing_indexes(database=None):
+    """Return (collection, index name) pairs for indexes that do not exist yet."""
+    database = db.get_db() if database is None else database
+    missing = []
+    for collection_name, models in INDEXES.items():
+        existing = {
+            tuple(info["key"]) for info in
+            database[collection_name].index_information().values()
+        }
+        for model in models:
+            if _index_keys(model.document) not in existing:
+                missing.append((collection_name, model.document["name"]))
+    return missing
+
+
+class IndexBuildError(Exception):
+    """One or more indexes could not be built; the rest were."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__("; ".join(
+            f"{collection_name}.{index_name}: {error}"
+            for collection_name, index_name, error in failures))
+
+
+def ensure_indexes(database=None):
+    """Create any missing indexes. Existing indexes are left untouched.
+
+    Each index is built on its own, so one that cannot be built (a unique
+    index over duplicate values) does not hold back the others. Raises
+    IndexBuildError listing the failures once every index has been tried.
+    """
+    database = db.get_db() if database is None else database
+    failures = []
+    for collection_name, models in INDEXES.items():
+        for model in models:
+            try:
+                database[collection_name].create_indexes([model])
+            except OperationFailure as e:
+                failures.append((collection_name, model.document["name"], str(e)))
+    if failures:
+        raise IndexBuildError(failures)
+
+
+def unique_conflicts(database=None, sample_size=5):
+    """Return (collection, index name, duplicated values) for missing unique indexes.
+
+    Duplicated values are a sample of the key values held by more than one
+    document, which have to be resolved before the index can be built.
+    """
+    database = db.get_db() if database is None else database
+    missing = set(missing_indexes(database))
+    conflicts = []
+    for collection_name, models in INDEXES.items():
+        for model in models:
+            name = model.document["name"]
+            if not model.document.get("unique") or (collection_name, name) not in missing:
+                continue
+            fields = list(model.document["key"])
+            duplicates = database[collection_name].aggregate([
+                {"$group": {"_id": {f: f"${f}" for f in fields}, "count": {"$sum": 1}}},
+                {"$match": {"count": {"$gt": 1}}},
+                {"$limit": sample_size},
+            ])
+            values = [
+                group["_id"][fields[0]] if len(fields) == 1 else group["_id"]
+                for group in duplicates
+            ]
+            if values:
+                conflicts.append((collection_name, name, values))
+    return conflicts
+
+
+# --- MIGRATIONS ---
+# Each migration is (version, description, function(database)). Applied
+# versions are recorded in the "migrations" collection and never run twice.
+
+
+def _merge_duplicate_attendance(database):
+    """Fold repeated saves for the same training and date into one document.
+
+    Later saves win, which is how the Training Status page already read them.
+    Must run before a unique (training, date) index can be built.
+    """
+    attendance = database["attendance"]
+    duplicates = attendance.aggregate([
+        {"$group": {
+            "_id": {"training_name": "$training_name", "date": "$date"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ])
+
+    updates, deletes = [], []
+    for group in duplicates:
+        records = list(attendance.find(
+            {"_id": {"$in": group["ids"]}}).sort("_id", ASCENDING))
+        merged_attendance, topic = {}, ""
+        for record in records:
+            merged_attendance.update(record.get("attendance", {}))
+            topic = record.get("topic") or topic
+
+        keep, *extra = records
+        updates.append(UpdateOne(
+            {"_id": keep["_id"]},
+            {"$set": {"attendance": merged_attendance, "topic": topic}}
+        ))
+        deletes.append(DeleteMany({"_id": {"$in": [r["_id"] for r in extra]}}))
+
+    if updates:
+        attendance.bulk_write(updates + deletes, ordered=False)
+
+
+def _bulk_write_in_batches(collection, requests):
+    """Write an iterable of bulk requests MIGRATION_BATCH_SIZE at a time."""
+    batch = []
+    for request in requests:
+        batch.append(request)
+        if len(batch) == MIGRATION_BATCH_SIZE:
+            collection.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.bulk_write(batch, ordered=False)
+
+
+def _ids_by_name(collection, name_field, names, placeholder):
+    """Map names to _ids, inserting placeholder(name) for names with no document.
+
+    Where a name is shared the oldest document wins.
+    """
+    names = list(names)
+    ids = {}
+    for document in collection.find(
+            {name_field: {"$in": names}}, {name_field: 1}).sort("_id", ASCENDING):
+        ids.setdefault(document[name_field], document["_id"])
+    missing = [name for name in names if name not in ids]
+    if missing:
+        result = collection.insert_many([placeholder(name) for name in missing])
+        ids.update(zip(missing, result.inserted_ids))
+    return ids
+
+
+def _participant_ids_by_name(database, names):
+    return _ids_by_name(
+        database["participants"], "participant_name", names,
+        lambda name: repository.with_search_keys(
+            {"participant_name": name, "email": "", "phone": ""}))
+
+
+def _compact_attendance(database):
+    """Rewrite {name: bool} attendance dicts as participant_ids + present arrays.
+
+    Names without a participant record get a bare one so no mark is lost.
+    """
+    attendance = database["attendance"]
+    legacy = {"attendance": {"$exists": True}}
+
+    names = {
+        row["_id"] for row in attendance.aggregate([
+            {"$match": legacy},
+            {"$project": {"marks": {"$objectToArray": "$attendance"}}},
+            {"$unwind": "$marks"},
+            {"$group": {"_id": "$marks.k"}},
+        ])
+    }
+    ids = _participant_ids_by_name(database, names)
+
+    _bulk_write_in_batches(attendance, (
+        UpdateOne({"_id": record["_id"]}, {
+            "$set": {
+                "participant_ids": [ids[name] for name in record["attendance"]],
+                "present": [bool(status) for status in record["attendance"].values()],
+            },
+            "$unset": {"attendance": ""},
+        })
+        for record in attendance.find(legacy, {"attendance": 1})
+    ))
+
+
+def _add_participant_search_keys(database):
+    """Backfill search_keys for participants saved before search existed."""
+    participants = database["participants"]
+    _bulk_write_in_batches(participants, (
+        UpdateOne({"_id": participant["_id"]}, {"$set": {
+            "search_keys": repository.search_keys(
+                participant.get("participant_name"), participant.get("email")),
+        }})
+        for participant in participants.find(
+            {"search_keys": {"$exists": False}},
+            {"participant_name": 1, "email": 1})
+    ))
+
+
+def _reference_by_id(database):
+    """Replace name references with _id references.
+
+    trainings.participants becomes participant_ids, attendance and removals
+    get training_id (and participant_id) instead of names. Names that no
+    longer match a document get a placeholder training or participant so no
+    history is dropped. Rollups are rebuilt under the new keys.
+    """
+    trainings = database["trainings"]
+    attendance = database["attendance"]
+    removals = database["removals"]
+
+    # The name-keyed unique index would reject records once names are unset
+    for collection, index_names in (
+            (attendance, ["training_date_unique"]),
+            (removals, ["training_participant", "training_removed_on_id"])):
+        existing = collection.index_information()
+        for index_name in index_names:
+            if index_name in existing:
+                collection.drop_index(index_name)
+
+    participant_names = set(trainings.distinct("participants"))
+    participant_names.update(removals.distinct("participant_name"))
+    participant_ids = _participant_ids_by_name(database, participant_names)
+
+    training_names = set(attendance.distinct("training_name"))
+    training_names.update(removals.distinct("training_name"))
+    training_ids = _ids_by_name(
+        trainings, "training_name", training_names,
+        lambda name: {"training_name": name, "trainer_name": "", "start_date": "",
+                      "training_days": [], "participant_ids": []})
+
+    _bulk_write_in_batches(trainings, (
+        UpdateOne({"_id": training["_id"]}, {
+            "$set": {"participant_ids": [participant_ids[name]
+                                         for name in training["participants"]]},
+            "$unset": {"participants": ""},
+        })
+        for training in trainings.find(
+            {"participants": {"$exists": True}}, {"participants": 1})
+    ))
+    _bulk_write_in_batches(attendance, (
+        UpdateOne({"_id": record["_id"]}, {
+            "$set": {"training_id": training_ids[record["training_name"]]},
+            "$unset": {"training_name": ""},
+        })
+        for record in attendance.find(
+            {"training_name": {"$exists": True}}, {"training_name": 1})
+    ))
+    _bulk_write_in_batches(removals, (
+        UpdateOne({"_id": removal["_id"]}, {
+            "$set": {
+                "training_id": training_ids[removal["training_name"]],
+                "participant_id": participant_ids[removal["participant_name"]],
+            },
+            "$unset": {"training_name": "", "participant_name": ""},
+        })
+        for removal in removals.find(
+            {"training_name": {"$exists": True}},
+            {"training_name": 1, "participant_name": 1})
+    ))
+
+    database["attendance_rollups"].delete_many({})
+    rollups.rebuild()
+
+
+def _normalize_emails(database):
+    """Strip and lower-case stored emails so Bulk Upload upserts match them.
+
+    Participants whose emails only differed by case now share one; they are
+    logged rather than merged, since each may have its own attendance.
+    """
+    participants = database["participants"]
+    _bulk_write_in_batches(participants, (
+        UpdateOne({"_id": participant["_id"]}, {"$set": {
+            "email": repository.normalize_email(participant["email"]),
+            "search_keys": repository.search_keys(
+                participant.get("participant_name"), participant["email"]),
+        }})
+        for participant in participants.find(
+            {"email": {"$type": "string"}}, {"participant_name": 1, "email": 1})
+        if participant["email"] != repository.normalize_email(participant["email"])
+    ))
+
+    for group in participants.aggregate([
+            {"$match": {"email": {"$nin": ["", None]}}},
+            {"$group": {"_id": "$email", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}]):
+        logger.warning("%s participants share the email %s; merge them by hand",
+                       group["count"], group["_id"])
+
+
+def _add_lowered_fields(database):
+    """Backfill the lower-cased names the View tables sort and filter on.
+
+    The (name, _id) indexes they replace are dropped, as is the single-field
+    email index, which email_id now covers as its prefix.
+    """
+    for collection_name, fields in (
+            ("trainings", ["training_name", "trainer_name"]),
+            ("participants", ["participant_name"])):
+        collection = database[collection_name]
+        _bulk_write_in_batches(collection, (
+            UpdateOne({"_id": document["_id"]}, {"$set": {
+                key: value for key, value in
+                repository.with_lowered_fields(document).items()
+                if key.endswith("_lower")
+            }})
+            for document in collection.find({}, dict.fromkeys(fields, 1))
+        ))
+        existing = collection.index_information()
+        for field in fields:
+            if f"{field}_id" in existing:
+                collection.drop_index(f"{field}_id")
+    if "email" in database["participants"].index_information():
+        database["participants"].drop_index("email")
+
+
+def _add_rollup_session_dates(database):
+    """Rebuild rollups so they list the dates of every recorded session."""
+    rollups.rebuild()
+
+
+MIGRATIONS = [
+    (1, "merge duplicate attendance saves", _merge_duplicate_attendance),
+    (2, "compact attendance records to participant ids", _compact_attendance),
+    (3, "add participant search keys", _add_participant_search_keys),
+    (4, "reference trainings and participants by id", _reference_by_id),
+    (5, "add session dates to attendance rollups", _add_rollup_session_dates),
+    (6, "normalize participant emails", _normalize_emails),
+    (7, "store lower-cased names for paging", _add_lowered_fields),
+]
+
+
+def applied_versions(database=None):
+    database = db.get_db() if database is None else database
+    return {m["_id"] for m in database["migrations"].find({}, {"_id": 1})}
+
+
+def pending_migrations(database=None):
+    applied = applied_versions(database)
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+
+def migrate(database=None):
+    """Apply pending migrations in version order, then build missing indexes.
+
+    Returns the versions that were applied.
+    """
+    database = db.get_db() if database is None else database
+    applied = []
+    for version, description, migration in pending_migrations(database):
+        logger.info("Applying migration %s: %s", version, description)
+        migration(database)
+        database["migrations"].insert_one({
+            "_id": version,
+            "description": description,
+            "applied_on": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        applied.append(version)
+    ensure_indexes(database)
+    return applied
+
+
+# --- STARTUP ---
+
+_bootstrapped = False
+_bootstrap_lock = threading.Lock()
+
+
+def bootstrap():
+    """Run migrate() once per server process unless AUTO_MIGRATE is off.
+
+    An index that cannot be built is logged and the app keeps serving (users
+    can still log in); it is not retried until the process restarts. Any
+    other failure leaves the schema half-migrated, so it is raised, and
+    migrate() is retried on every later call until it succeeds.
+    """
+    global _bootstrapped
+    if _bootstrapped or not AUTO_MIGRATE:
+        return
+    with _bootstrap_lock:
+        if not _bootstrapped:
+            try:
+                migrate()
+            except IndexBuildError:
+                logger.exception(
+                    "Startup index build failed; run `python manage.py check-indexes` "
+                    "to see what is blocking it, then `python manage.py migrate`")
+            _bootstrapped = True
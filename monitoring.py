@@ -0,0 +1,190 @@
+"""Per-page MongoDB command monitoring.
+
+A pymongo CommandListener attributes every command to the measurement that
+is open on the calling thread, so each Streamlit rerun (or background job)
+ends up as one record of wall time, commands sent, queries, documents
+returned and time spent waiting on the server. Records are kept in a
+bounded in-memory history and written to the "monitoring" logger as JSON.
+
+The per-command breakdown counts commands by name and collection; the same
+query repeated once per row is the N+1 pattern to look for.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+from pymongo.monitoring import CommandListener
+
+logger = logging.getLogger(__name__)
+
+# Set MONITORING_ENABLED=0 to skip registering the command listener
+MONITORING_ENABLED = os.getenv("MONITORING_ENABLED", "1") == "1"
+
+# Records kept in memory for the admin panel and metrics export
+MONITORING_HISTORY = int(os.getenv("MONITORING_HISTORY", "1000"))
+
+QUERY_COMMANDS = {"find", "aggregate", "count", "distinct"}
+WRITE_COMMANDS = {"insert", "update", "delete", "findAndModify"}
+
+# --- MEASUREMENTS ---
+
+_current = threading.local()
+_history = deque(maxlen=MONITORING_HISTORY)
+_history_lock = threading.Lock()
+
+
+def _new_measurement(label):
+    return {
+        "label": label,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "start": time.perf_counter(),
+        "commands": 0,
+        "queries": 0,
+        "get_mores": 0,
+        "writes": 0,
+        "failures": 0,
+        "docs_returned": 0,
+        "db_micros": 0,
+        "breakdown": Counter(),
+    }
+
+
+def begin(label):
+    """Start measuring commands issued by this thread under label.
+
+    Any measurement left open on the thread (a rerun that stopped early)
+    is discarded.
+    """
+    _current.measurement = _new_measurement(label)
+
+
+def end():
+    """Finish this thread's measurement, record it and return the record."""
+    measurement = getattr(_current, "measurement", None)
+    _current.measurement = None
+    if measurement is None:
+        return None
+
+    wall_seconds = time.perf_counter() - measurement.pop("start")
+    db_micros = measurement.pop("db_micros")
+    breakdown = measurement.pop("breakdown")
+    record = dict(
+        measurement,
+        wall_ms=round(wall_seconds * 1000, 1),
+        db_ms=round(db_micros / 1000, 1),
+        most_repeated=breakdown.most_common(1)[0] if breakdown else None,
+        breakdown=dict(breakdown),
+    )
+    with _history_lock:
+        _history.append(record)
+    logger.info("%s", json.dumps(record))
+    return record
+
+
+@contextmanager
+def measure(label):
+    """Measure a block; restores any measurement that was open around it.
+
+    Yields a dict that is filled with the finished record on exit.
+    """
+    outer = getattr(_current, "measurement", None)
+    record = {}
+    begin(label)
+    try:
+        yield record
+    finally:
+        record.update(end() or {})
+        _current.measurement = outer
+
+
+# --- COMMAND LISTENER ---
+
+
+def _docs_in_reply(reply):
+    cursor = reply.get("cursor")
+    if cursor is not None:
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if "values" in reply:
+        return len(reply["values"])
+    return 0
+
+
+class CommandTimer(CommandListener):
+    """Adds every command this thread sends to its open measurement."""
+
+    def started(self, event):
+        measurement = getattr(_current, "measurement", None)
+        if measurement is None:
+            return
+        name = event.command_name
+        measurement["commands"] += 1
+        if name in QUERY_COMMANDS:
+            measurement["queries"] += 1
+        elif name == "getMore":
+            measurement["get_mores"] += 1
+        elif name in WRITE_COMMANDS:
+            measurement["writes"] += 1
+        target = event.command.get(name)
+        if name == "getMore":
+            target = event.command.get("collection")
+        measurement["breakdown"][f"{name} {target}" if isinstance(target, str) else name] += 1
+
+    def succeeded(self, event):
+        measurement = getattr(_current, "measurement", None)
+        if measurement is None:
+            return
+        measurement["db_micros"] += event.duration_micros
+        measurement["docs_returned"] += _docs_in_reply(event.reply)
+
+    def failed(self, event):
+        measurement = getattr(_current, "measurement", None)
+        if measurement is None:
+            return
+        measurement["db_micros"] += event.duration_micros
+        measurement["failures"] += 1
+
+
+command_listener = CommandTimer()
+
+
+# --- REPORTING ---
+
+
+def history():
+    with _history_lock:
+        return list(_history)
+
+
+def clear_history():
+    with _history_lock:
+        _history.clear()
+
+
+def summary():
+    """Per-label averages and tail latency over the recorded history."""
+    records = pd.DataFrame(history())
+    if records.empty:
+        return pd.DataFrame()
+    grouped = records.groupby("label")
+    return pd.DataFrame({
+        "Runs": grouped.size(),
+        "Avg ms": grouped["wall_ms"].mean().round(1),
+        "p95 ms": grouped["wall_ms"].quantile(0.95).round(1),
+        "Avg DB ms": grouped["db_ms"].mean().round(1),
+        "Avg queries": grouped["queries"].mean().round(1),
+        "Avg round trips": grouped["commands"].mean().round(1),
+        "Avg docs": grouped["docs_returned"].mean().round(1),
+        "Max repeats": grouped["most_repeated"].agg(
+            lambda repeats: max((r[1] for r in repeats if r), default=0)),
+    }).sort_values("Avg ms", ascending=False)
+
+
+def history_json_lines():
+    """The recorded history as JSON lines, for download."""
+    return "\n".join(json.dumps(record) for record in history())
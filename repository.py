@@ -0,0 +1,766 @@
+"""Data access for the Training Management System.
+
+Every page in app.py reads and writes MongoDB through these functions so the
+queries live in one place and all of them share the pooled client in db.py.
+"""
+import math
+import os
+import re
+import threading
+from datetime import datetime
+
+from cachetools import TTLCache
+from gridfs.errors import NoFile
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import db
+
+# How long cached lookups may be served before re-reading MongoDB. Writes made
+# through this module invalidate immediately; the TTL only bounds staleness
+# for writes made by other server processes.
+READ_CACHE_TTL_SECONDS = int(os.getenv("READ_CACHE_TTL_SECONDS", "60"))
+
+# --- READ CACHE ---
+# Keys are tuples whose first element names the collection they were read
+# from, so a write can drop everything derived from that collection.
+
+_read_cache = TTLCache(maxsize=256, ttl=READ_CACHE_TTL_SECONDS)
+_read_cache_lock = threading.Lock()
+_read_cache_generation = 0
+
+
+def _cached(key, loader):
+    """Return the cached value for key, calling loader() on a miss.
+
+    A value loaded while a write invalidated the cache is returned but not
+    stored, so a slow read can never put stale data back after a write.
+    """
+    with _read_cache_lock:
+        if key in _read_cache:
+            return _read_cache[key]
+        generation = _read_cache_generation
+
+    value = loader()
+
+    with _read_cache_lock:
+        if generation == _read_cache_generation:
+            _read_cache[key] = value
+    return value
+
+
+def invalidate_cache(*collections):
+    """Drop cached reads for the given collections, or everything if none given."""
+    global _read_cache_generation
+    with _read_cache_lock:
+        _read_cache_generation += 1
+        if not collections:
+            _read_cache.clear()
+            return
+        for key in [k for k in _read_cache if k[0] in collections]:
+            del _read_cache[key]
+
+
+# --- PAGINATION ---
+# Names the View tables sort and filter on are also stored lower-cased as
+# <field>_lower, so "starts with" is a case-sensitive anchored regex that the
+# (<field>_lower, _id) indexes bound like a range instead of scanning every key.
+
+LOWERED_FIELDS = ("training_name", "trainer_name", "participant_name")
+
+
+def as_text(value):
+    """A stored value as a string; None and NaN (blank legacy cells) become ""."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    return str(value)
+
+
+def with_lowered_fields(document):
+    """Copy of document with <field>_lower set for each LOWERED_FIELDS it has."""
+    document = dict(document)
+    for field in LOWERED_FIELDS:
+        if field in document:
+            document[f"{field}_lower"] = as_text(document[field]).strip().lower()
+    return document
+
+
+def page_key(field):
+    """The stored field a View table sorts and filters on for a column."""
+    return f"{field}_lower" if field in LOWERED_FIELDS else field
+
+
+def prefix_filter(field, text):
+    """Case-insensitive "starts with" match on field, or no filter for blank text."""
+    text = (text or "").strip().lower()
+    if not text:
+        return {}
+    return {page_key(field): {"$regex": "^" + re.escape(text)}}
+
+
+def find_page(collection, query, projection, sort_field, ascending=True,
+              after=None, limit=50, join=()):
+    """One page of documents ordered by (sort_field, _id).
+
+    Uses keyset pagination: after is the (sort value, _id) of the last row of
+    the previous page, so every page is an index range scan no matter how
+    deep it is. join stages (e.g. a $lookup) run on the sorted stream before
+    the limit, and projection may use aggregation expressions. Returns
+    (rows, next_after), where next_after is None on the last page.
+    """
+    direction = 1 if ascending else -1
+    beyond = "$gt" if ascending else "$lt"
+
+    match = query
+    if after is not None:
+        value, last_id = after
+        match = {"$and": [query, {"$or": [
+            {sort_field: {beyond: value}},
+            {sort_field: value, "_id": {beyond: last_id}},
+        ]}]}
+
+    rows = list(collection.aggregate([
+        {"$match": match},
+        {"$sort": {sort_field: direction, "_id": direction}},
+        *join,
+        {"$limit": limit + 1},
+        {"$project": dict(projection, **{sort_field: 1})},
+    ]))
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, (rows[-1].get(sort_field), rows[-1]["_id"])
+
+
+# --- USERS ---
+
+
+def authenticate(username, password):
+    user = db.users_collection().find_one(
+        {"username": username, "password": password}, {"_id": 1})
+    return user is not None
+
+
+# --- TRAININGS ---
+
+
+def trainings_page(sort_field="training_name", ascending=True, starts_with="",
+                   after=None, limit=50):
+    """A page of trainings filtered by a prefix of the sort field.
+
+    Only the fields shown in the View table are returned; participants are
+    reduced to a count.
+    """
+    return find_page(
+        db.trainings_collection(),
+        prefix_filter(sort_field, starts_with),
+        {"training_name": 1, "trainer_name": 1, "start_date": 1, "end_date": 1,
+         "training_days": 1,
+         "participant_count": {"$size": {"$ifNull": ["$participant_ids", []]}}},
+        page_key(sort_field), ascending, after, limit
+    )
+
+
+def training_choices():
+    """{_id: training_name} sorted by name for selectors, served from the read cache."""
+    def load():
+        cursor = db.trainings_collection().find(
+            {}, {"training_name": 1}).sort("training_name", 1)
+        return {t["_id"]: t["training_name"] for t in cursor}
+    return _cached(("trainings", "choices"), load)
+
+
+def training_labels():
+    """{_id: (training_name, trainer_name)} for every training, served from the read cache."""
+    def load():
+        cursor = db.trainings_collection().find(
+            {}, {"training_name": 1, "trainer_name": 1})
+        return {t["_id"]: (t.get("training_name", ""), t.get("trainer_name", ""))
+                for t in cursor}
+    return _cached(("trainings", "labels"), load)
+
+
+def get_training(training_id):
+    """Cached training document. Callers must treat it as read-only."""
+    return _cached(
+        ("trainings", "doc", training_id),
+        lambda: db.trainings_collection().find_one({"_id": training_id})
+    )
+
+
+def find_training_id(training_name):
+    """_id of the (oldest) training with this name, or None."""
+    training = db.trainings_collection().find_one(
+        {"training_name": training_name}, {"_id": 1}, sort=[("_id", 1)])
+    return training["_id"] if training else None
+
+
+def training_participants(training_id):
+    """Participants on a training as _id/name/email dicts, sorted by name.
+
+    Names are joined in from participants with an _id-indexed $lookup, so a
+    rename shows up everywhere without touching the training.
+    """
+    return list(db.trainings_collection().aggregate([
+        {"$match": {"_id": training_id}},
+        {"$project": {"participant_ids": 1}},
+        {"$lookup": {
+            "from": "participants",
+            "localField": "participant_ids",
+            "foreignField": "_id",
+            "as": "participants",
+        }},
+        {"$unwind": "$participants"},
+        {"$replaceRoot": {"newRoot": "$participants"}},
+        {"$project": {"participant_name": 1, "email": 1}},
+        {"$sort": {"participant_name": 1}},
+    ]))
+
+
+def create_training(training):
+    db.trainings_collection().insert_one(
+        with_lowered_fields(dict(training, participant_ids=[])))
+    invalidate_cache("trainings")
+
+
+def update_training(training_id, fields):
+    db.trainings_collection().update_one(
+        {"_id": training_id}, {"$set": with_lowered_fields(fields)})
+    invalidate_cache("trainings")
+
+
+def delete_training(training_id):
+    """Delete a training with its attendance, removals and rollup."""
+    def cascade(session):
+        db.trainings_collection().delete_one({"_id": training_id}, session=session)
+        db.attendance_collection().delete_many(
+            {"training_id": training_id}, session=session)
+        db.removals_collection().delete_many(
+            {"training_id": training_id}, session=session)
+        db.rollups_collection().delete_one({"_id": training_id}, session=session)
+
+    db.run_in_transaction(cascade)
+    invalidate_cache("trainings", "attendance")
+
+
+def assign_participants(training_id, participant_ids):
+    db.trainings_collection().update_one(
+        {"_id": training_id},
+        {"$addToSet": {"participant_ids": {"$each": list(participant_ids)}}}
+    )
+    invalidate_cache("trainings")
+
+
+def remove_participants(training_id, participant_ids, reason):
+    """Pull participants from a training and log each removal with its reason."""
+    removed_on = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def remove(session):
+        db.trainings_collection().update_one(
+            {"_id": training_id},
+            {"$pull": {"participant_ids": {"$in": list(participant_ids)}}},
+            session=session
+        )
+        # Record the removals with reason and timestamp
+        db.removals_collection().insert_many([{
+            "training_id": training_id,
+            "participant_id": participant_id,
+            "reason": reason,
+            "removed_on": removed_on
+        } for participant_id in participant_ids], session=session)
+
+    db.run_in_transaction(remove)
+    invalidate_cache("trainings")
+
+
+# --- REMOVALS ---
+
+
+def removals_page(training_id, participant_starts_with="", after=None, limit=50):
+    """A page of a training's removals, newest first, with participant names."""
+    join = [
+        {"$lookup": {
+            "from": "participants",
+            "localField": "participant_id",
+            "foreignField": "_id",
+            "as": "participant",
+        }},
+        {"$set": {
+            "participant_name": {"$first": "$participant.participant_name"},
+            "participant_name_lower": {"$first": "$participant.participant_name_lower"},
+        }},
+    ]
+    name_filter = prefix_filter("participant_name", participant_starts_with)
+    if name_filter:
+        join.append({"$match": name_filter})
+
+    return find_page(
+        db.removals_collection(),
+        {"training_id": training_id},
+        {"participant_name": 1, "reason": 1},
+        "removed_on", False, after, limit, join
+    )
+
+
+def removed_participant_ids(training_id):
+    removed = db.removals_collection().find(
+        {"training_id": training_id}, {"participant_id": 1})
+    return {entry["participant_id"] for entry in removed}
+
+
+# --- PARTICIPANTS ---
+
+
+def participants_page(sort_field="participant_name", ascending=True,
+                      starts_with="", after=None, limit=50):
+    """A page of participants filtered by a prefix of the sort field."""
+    return find_page(
+        db.participants_collection(),
+        prefix_filter(sort_field, starts_with),
+        {"participant_name": 1, "email": 1, "phone": 1},
+        page_key(sort_field), ascending, after, limit
+    )
+
+
+def search_keys(participant_name, email):
+    """Lowercased name, each word of the name, and email, for prefix search."""
+    name = as_text(participant_name).strip().lower()
+    keys = {name, normalize_email(email), *name.split()}
+    keys.discard("")
+    return sorted(keys)
+
+
+def normalize_email(email):
+    """Emails are stored stripped and lower-cased; Bulk Upload upserts on them."""
+    return as_text(email).strip().lower()
+
+
+def with_search_keys(participant):
+    """Participant fields as stored: email normalised, search and sort keys added."""
+    participant = with_lowered_fields(participant)
+    if "email" in participant:
+        participant["email"] = normalize_email(participant["email"])
+    participant["search_keys"] = search_keys(
+        participant.get("participant_name"), participant.get("email"))
+    return participant
+
+
+def search_participants(text, limit=20):
+    """Participants whose name, any word of their name, or email starts with text.
+
+    A prefix is served by the multikey search_keys index, so it costs one
+    index range scan however many participants there are. The first limit
+    matches are sorted by name here; sorting in MongoDB would fetch every
+    match first. Returns _id, name and email.
+    """
+    text = (text or "").strip().lower()
+    query = {"search_keys": {"$regex": "^" + re.escape(text)}} if text else {}
+    matches = db.participants_collection().find(
+        query, {"participant_name": 1, "email": 1}
+    ).limit(limit)
+    return sorted(matches, key=lambda p: as_text(p.get("participant_name")).lower())
+
+
+def get_participant(participant_id):
+    return db.participants_collection().find_one({"_id": participant_id})
+
+
+def participant_ids_by_email(emails):
+    """{email: _id} for the participants with these (lower-case) emails."""
+    cursor = db.participants_collection().find(
+        {"email": {"$in": list(emails)}}, {"email": 1})
+    return {p["email"]: p["_id"] for p in cursor}
+
+
+def add_participant(participant):
+    db.participants_collection().insert_one(with_search_keys(participant))
+    invalidate_cache("participants")
+
+
+def upsert_participants(participants):
+    """Insert or update participants keyed on email in one unordered bulk write.
+
+    Returns the upserted and modified counts plus (position, message) pairs
+    for records the server rejected.
+    """
+    requests = [
+        UpdateOne({"email": p["email"]}, {"$set": with_search_keys(p)}, upsert=True)
+        for p in participants
+    ]
+    try:
+        result = db.participants_collection().bulk_write(requests, ordered=False)
+        details = result.bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+    finally:
+        invalidate_cache("participants")
+
+    return {
+        "upserted": details.get("nUpserted", 0),
+        "modified": details.get("nModified", 0),
+        "errors": [(err["index"], err["errmsg"])
+                   for err in details.get("writeErrors", [])],
+    }
+
+
+def update_participant(participant_id, fields):
+    """Update a participant's name, email and phone.
+
+    Everything else refers to the participant by _id, so a rename needs no
+    cascade.
+    """
+    db.participants_collection().update_one(
+        {"_id": participant_id}, {"$set": with_search_keys(fields)})
+    invalidate_cache("participants")
+
+
+def delete_participant(participant_id):
+    """Delete a participant and every reference to them.
+
+    Trainings, attendance, removals and rollups each get one batched write.
+    """
+    rollup_key = f"participants.{participant_id}"
+    # Marks live in parallel arrays, so each affected session drops the
+    # participant's (id, present) pair server-side and splits the rest back
+    kept = {"$filter": {
+        "input": {"$zip": {"inputs": ["$participant_ids", "$present"]}},
+        "cond": {"$ne": [{"$arrayElemAt": ["$$this", 0]}, participant_id]},
+    }}
+    drop_marks = [
+        {"$set": {"kept": kept}},
+        {"$set": {
+            "participant_ids": {"$map": {"input": "$kept",
+                                         "in": {"$arrayElemAt": ["$$this", 0]}}},
+            "present": {"$map": {"input": "$kept",
+                                 "in": {"$arrayElemAt": ["$$this", 1]}}},
+        }},
+        {"$unset": "kept"},
+    ]
+
+    def cascade(session):
+        db.participants_collection().delete_one(
+            {"_id": participant_id}, session=session)
+        db.trainings_collection().update_many(
+            {"participant_ids": participant_id},
+            {"$pull": {"participant_ids": participant_id}}, session=session)
+        db.attendance_collection().update_many(
+            {"participant_ids": participant_id}, drop_marks, session=session)
+        db.removals_collection().delete_many(
+            {"participant_id": participant_id}, session=session)
+        db.rollups_collection().update_many(
+            {rollup_key: {"$exists": True}},
+            {"$unset": {rollup_key: ""}, "$inc": {"version": 1}},
+            session=session)
+
+    db.run_in_transaction(cascade)
+    invalidate_cache("participants", "trainings", "attendance")
+
+
+# --- ATTENDANCE ---
+
+
+class AttendanceConflict(Exception):
+    """A conditional session save found the session changed since it was read."""
+
+
+def save_attendance(attendance_records, session=None, expected=None):
+    """Upsert compact session records in one unordered bulk write.
+
+    Each record holds training_id, date, topic, participant_ids and a
+    parallel present array, and replaces any earlier save for its
+    (training_id, date). Returns the (training_id, date) pairs that were
+    already saved. Inside a transaction the caller invalidates the read
+    cache once it commits.
+
+    expected optionally maps (training_id, date) to the (participant_ids,
+    present) arrays the caller read, or None if the session was not saved
+    yet. Those records are only written if the stored session still matches,
+    and AttendanceConflict is raised if any of them did not; the others are
+    written regardless.
+    """
+    expected = expected or {}
+    requests = []
+    for record in attendance_records:
+        key = (record["training_id"], record["date"])
+        query = {"training_id": record["training_id"], "date": record["date"]}
+        upsert = True
+        if key in expected and expected[key] is None:
+            # Matches no saved session, so if one was saved since, the
+            # upsert's insert fails on the unique (training_id, date) index
+            query["participant_ids"] = {"$exists": False}
+        elif key in expected:
+            query["participant_ids"], query["present"] = expected[key]
+            upsert = False
+        requests.append(ReplaceOne(query, record, upsert=upsert))
+
+    try:
+        details = db.attendance_collection().bulk_write(
+            requests, ordered=False, session=session).bulk_api_result
+    except BulkWriteError as e:
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+        details = e.details
+    finally:
+        if session is None:
+            invalidate_cache("attendance")
+    if details["nMatched"] + details["nUpserted"] < len(requests):
+        raise AttendanceConflict(
+            f"{len(requests) - details['nMatched'] - details['nUpserted']} "
+            "sessions changed since they were read")
+
+    upserted = {upsert["index"] for upsert in details["upserted"]}
+    return {
+        (record["training_id"], record["date"])
+        for index, record in enumerate(attendance_records)
+        if index not in upserted
+    }
+
+
+def saved_attendance(training_id, dates):
+    """Saved sessions for the given dates as {date: (topic, {participant_id: present})}."""
+    records = db.attendance_collection().find(
+        {"training_id": training_id, "date": {"$in": list(dates)}},
+        {"_id": 0, "date": 1, "topic": 1, "participant_ids": 1, "present": 1}
+    )
+    return {
+        record["date"]: (
+            record.get("topic", ""),
+            dict(zip(record.get("participant_ids", []), record.get("present", [])))
+        )
+        for record in records
+    }
+
+
+def session_totals(start_date=None, end_date=None):
+    """Marks and presents per saved session, optionally in a date range.
+
+    The counting happens server-side, so only four small fields per session
+    come back. Served from the read cache; attendance writes invalidate it.
+    """
+    def load():
+        query = {}
+        if start_date or end_date:
+            query["date"] = {}
+            if start_date:
+                query["date"]["$gte"] = start_date
+            if end_date:
+                query["date"]["$lte"] = end_date
+        return list(db.attendance_collection().aggregate([
+            {"$match": query},
+            {"$project": {
+                "_id": 0, "training_id": 1, "date": 1,
+                "marks": {"$size": {"$ifNull": ["$present", []]}},
+                "present": {"$size": {"$filter": {
+                    "input": {"$ifNull": ["$present", []]},
+                    "cond": {"$eq": ["$$this", True]},
+                }}},
+            }},
+        ]))
+    return _cached(("attendance", "totals", start_date, end_date), load)
+
+
+def attendance_training_ids():
+    return db.attendance_collection().distinct("training_id")
+
+
+def attendance_marks(training_id):
+    """One row per (date, participant_id) mark for a training, flattened server-side.
+
+    Dates saved without any marks still yield a row with participant_id None
+    so their topic is not lost.
+    """
+    return list(db.attendance_collection().aggregate([
+        {"$match": {"training_id": training_id}},
+        {"$project": {
+            "_id": 0, "date": 1, "topic": 1, "participant_ids": 1, "present": 1,
+        }},
+        {"$unwind": {
+            "path": "$participant_ids",
+            "includeArrayIndex": "position",
+            "preserveNullAndEmptyArrays": True,
+        }},
+        {"$project": {
+            "date": 1, "topic": 1,
+            "participant_id": "$participant_ids",
+            "present": {"$arrayElemAt": ["$present", "$position"]},
+        }},
+    ]))
+
+
+def export_trainings(training_ids=None):
+    """Cursor over the trainings with these _ids in name order, or every training if None."""
+    query = {} if training_ids is None else {"_id": {"$in": list(training_ids)}}
+    return db.trainings_collection().find(
+        query, {"training_name": 1, "trainer_name": 1, "participant_ids": 1}
+    ).sort([("training_name", 1), ("_id", 1)])
+
+
+def session_cursor(training_id, start_date=None, end_date=None, batch_size=500):
+    """Cursor over a training's saved sessions in date order, optionally in a date range.
+
+    Served by the (training_id, date) index; batch_size bounds how many
+    sessions each round trip brings back.
+    """
+    query = {"training_id": training_id}
+    date_range = {}
+    if start_date:
+        date_range["$gte"] = start_date
+    if end_date:
+        date_range["$lte"] = end_date
+    if date_range:
+        query["date"] = date_range
+    return db.attendance_collection().find(
+        query,
+        {"_id": 0, "date": 1, "topic": 1, "participant_ids": 1, "present": 1},
+        sort=[("date", 1)], batch_size=batch_size
+    )
+
+
+def participant_contacts(participant_ids):
+    """{_id: (participant_name, email)} for the given participants."""
+    cursor = db.participants_collection().find(
+        {"_id": {"$in": list(participant_ids)}},
+        {"participant_name": 1, "email": 1}
+    )
+    return {p["_id"]: (p.get("participant_name", ""), p.get("email", "")) for p in cursor}
+
+
+# --- HOLIDAYS ---
+
+
+def holidays():
+    """Sorted tuple of holiday dates, served from the read cache."""
+    return _cached(
+        ("holidays", "dates"),
+        lambda: tuple(h["date"] for h in db.holidays_collection().find(
+            {}, {"_id": 0, "date": 1}).sort("date", 1))
+    )
+
+
+def list_holidays():
+    return list(db.holidays_collection().find({}, {"_id": 0}).sort("date", 1))
+
+
+def add_holiday(date, name):
+    db.holidays_collection().update_one(
+        {"date": date}, {"$set": {"name": name}}, upsert=True)
+    invalidate_cache("holidays")
+
+
+def remove_holidays(dates):
+    db.holidays_collection().delete_many({"date": {"$in": list(dates)}})
+    invalidate_cache("holidays")
+
+
+# --- ROLLUPS ---
+
+
+def get_rollup(training_id, session=None):
+    return db.rollups_collection().find_one({"_id": training_id}, session=session)
+
+
+def replace_rollup(rollup, expected_version, session=None):
+    """Replace a rollup only if nobody else wrote it since expected_version.
+
+    Returns False when another writer got there first.
+    """
+    try:
+        result = db.rollups_collection().replace_one(
+            {"_id": rollup["_id"], "version": expected_version},
+            rollup,
+            upsert=expected_version == 0,
+            session=session
+        )
+    except DuplicateKeyError:
+        return False
+    return result.matched_count == 1 or result.upserted_id is not None
+
+
+def mark_rollups_pending(training_ids, token):
+    """Flag existing rollups as having an attendance write in flight."""
+    db.rollups_collection().update_many(
+        {"_id": {"$in": list(training_ids)}},
+        {"$push": {"pending": token}, "$inc": {"version": 1}})
+
+
+def mark_rollup_stale(training_id, token=None, session=None):
+    """Flag a rollup for rebuilding, clearing token from its pending writes."""
+    update = {"$set": {"stale": True}, "$inc": {"version": 1}}
+    if token is not None:
+        update["$pull"] = {"pending": token}
+    db.rollups_collection().update_one(
+        {"_id": training_id}, update, upsert=True, session=session)
+
+
+def delete_rollups_except(training_ids):
+    db.rollups_collection().delete_many({"_id": {"$nin": list(training_ids)}})
+
+
+# --- JOBS ---
+
+
+def create_job(job):
+    return db.jobs_collection().insert_one(job).inserted_id
+
+
+def update_job(job_id, fields):
+    db.jobs_collection().update_one({"_id": job_id}, {"$set": fields})
+
+
+def get_job(job_id):
+    return db.jobs_collection().find_one({"_id": job_id})
+
+
+def recent_jobs(owner=None, limit=20):
+    """Newest jobs first, optionally only those started by owner."""
+    query = {} if owner is None else {"owner": owner}
+    return list(db.jobs_collection().find(query).sort("created_at", -1).limit(limit))
+
+
+def touch_jobs(statuses, worker, heartbeat):
+    """Refresh the heartbeat of a worker's jobs that are still in statuses."""
+    db.jobs_collection().update_many(
+        {"status": {"$in": list(statuses)}, "worker": worker},
+        {"$set": {"heartbeat": heartbeat}}
+    )
+
+
+def interrupt_stale_jobs(statuses, heartbeat_before, finished_at, job_id=None):
+    """Mark jobs (or just job_id) that stopped reporting as interrupted."""
+    query = {"status": {"$in": list(statuses)}, "heartbeat": {"$lt": heartbeat_before}}
+    if job_id is not None:
+        query["_id"] = job_id
+    db.jobs_collection().update_many(
+        query,
+        {"$set": {"status": "interrupted", "finished_at": finished_at,
+                  "error": "The server stopped before the job finished."}}
+    )
+
+
+def delete_jobs_before(created_before):
+    """Delete finished jobs created before the cutoff, with their files."""
+    old_jobs = list(db.jobs_collection().find(
+        {"created_at": {"$lt": created_before},
+         "status": {"$in": ["succeeded", "failed", "interrupted"]}},
+        {"result.file_id": 1}
+    ))
+    bucket = db.job_files()
+    for job in old_jobs:
+        file_id = (job.get("result") or {}).get("file_id")
+        if file_id is not None:
+            try:
+                bucket.delete(file_id)
+            except NoFile:
+                pass
+    if old_jobs:
+        db.jobs_collection().delete_many({"_id": {"$in": [j["_id"] for j in old_jobs]}})
+
+
+def save_job_file(file_name, source):
+    """Copy a readable binary file into GridFS in chunks; returns its file _id."""
+    return db.job_files().upload_from_stream(file_name, source)
+
+
+def read_job_file(file_id):
+    return db.job_files().open_download_stream(file_id).read()
@@ -0,0 +1,238 @@
+"""Materialized attendance totals, one small document per training.
+
+Each rollup document looks like:
+
+    {
+        "_id": <training _id>,
+        "version": <int, bumped on every write>,
+        "sessions_held": <int>,
+        "last_session": "YYYY-MM-DD",
+        "session_dates": ["YYYY-MM-DD", ...],
+        "participants": {
+            <participant _id as a string>: {
+                "sessions": <sessions this participant was marked in>,
+                "present": <int>, "absent": <int>,
+                "last_attended": "YYYY-MM-DD" or None,
+                "current_streak": <consecutive presents up to the last mark>,
+                "longest_streak": <int>,
+            },
+        },
+    }
+
+Saving a new, later session updates the document in place. Corrections and
+back-dated saves change streaks retroactively, so they mark the document
+"stale" and it is rebuilt from the training's attendance history instead.
+A "pending" list holds a token per attendance write still being folded in
+on servers without transactions. Read rollups through current(), which
+rebuilds any that are stale or were left pending by a failed write.
+"""
+import pandas as pd
+from bson import ObjectId
+
+import db
+import repository
+
+
+def empty_rollup(training_id):
+    return {
+        "_id": training_id,
+        "version": 0,
+        "sessions_held": 0,
+        "last_session": None,
+        "session_dates": [],
+        "participants": {},
+    }
+
+
+def _apply_session(rollup, date, marks):
+    """Return a copy of rollup with one later session's marks added.
+
+    The caller bumps the version once per write.
+    """
+    updated = dict(rollup)
+    participants = {key: dict(stats) for key, stats in rollup["participants"].items()}
+
+    for participant_id, present in marks.items():
+        stats = participants.setdefault(str(participant_id), {
+            "sessions": 0, "present": 0, "absent": 0, "last_attended": None,
+            "current_streak": 0, "longest_streak": 0,
+        })
+        stats["sessions"] += 1
+        if present:
+            stats["present"] += 1
+            stats["last_attended"] = date
+            stats["current_streak"] += 1
+            stats["longest_streak"] = max(
+                stats["longest_streak"], stats["current_streak"])
+        else:
+            stats["absent"] += 1
+            stats["current_streak"] = 0
+
+    updated["participants"] = participants
+    updated["sessions_held"] = rollup["sessions_held"] + 1
+    updated["last_session"] = date
+    updated["session_dates"] = rollup.get("session_dates", []) + [date]
+    return updated
+
+
+def _fold_sessions(records, replaced, token=None, session=None):
+    """Fold just-written session records into their trainings' rollups.
+
+    Later, new sessions are applied in place with a compare-and-swap on the
+    version. Returns the training _ids whose rollups were marked stale
+    instead: the save corrected or back-dated a session, the rollup was
+    missing or already stale, or another writer got there first.
+    """
+    by_training = {}
+    for record in records:
+        by_training.setdefault(record["training_id"], []).append(record)
+
+    stale = set()
+    for training_id, saved in by_training.items():
+        rollup = repository.get_rollup(training_id, session=session)
+        saved = sorted(saved, key=lambda record: record["date"])
+        # Without a full rollup there may be history saved before rollups existed
+        incremental = (
+            rollup is not None and "participants" in rollup
+            and not rollup.get("stale")
+            and saved[0]["date"] > (rollup["last_session"] or "")
+            and not any((training_id, r["date"]) in replaced for r in saved)
+        )
+        if incremental:
+            updated = rollup
+            for record in saved:
+                updated = _apply_session(updated, record["date"], dict(
+                    zip(record["participant_ids"], record["present"])))
+            updated["version"] = rollup["version"] + 1
+            updated["pending"] = [t for t in rollup.get("pending", []) if t != token]
+            incremental = repository.replace_rollup(
+                updated, rollup["version"], session=session)
+        if not incremental:
+            repository.mark_rollup_stale(training_id, token, session=session)
+            stale.add(training_id)
+    return stale
+
+
+def save_sessions(records, rebuild_stale=True, expected=None):
+    """Write compact session records and fold them into their trainings' rollups.
+
+    Where transactions are available the attendance write and the rollup
+    update commit together. On a standalone server each affected rollup is
+    first marked pending, so if the process dies between the two writes the
+    next current() rebuilds it. Rollups that cannot be updated in place are
+    marked stale and rebuilt here, or on their next read if rebuild_stale is
+    False. expected makes the write conditional; see
+    repository.save_attendance().
+    """
+    if not records:
+        return
+    if db.supports_transactions():
+        def write(session):
+            replaced = repository.save_attendance(
+                records, session=session, expected=expected)
+            return _fold_sessions(records, replaced, session=session)
+
+        stale = db.run_in_transaction(write)
+        repository.invalidate_cache("attendance")
+    else:
+        token = ObjectId()
+        repository.mark_rollups_pending({r["training_id"] for r in records}, token)
+        replaced = repository.save_attendance(records, expected=expected)
+        stale = _fold_sessions(records, replaced, token)
+
+    if rebuild_stale:
+        for training_id in stale:
+            rebuild(training_id)
+
+
+def current(training_id):
+    """The training's rollup, rebuilt first if missing, stale or mid-write."""
+    rollup = repository.get_rollup(training_id)
+    if rollup is None or rollup.get("stale") or rollup.get("pending"):
+        rollup = rebuild(training_id)
+    return rollup
+
+
+def _participant_stats(marks):
+    """Per-participant totals and streaks from (date, participant, present) rows."""
+    marks = marks.sort_values(["participant", "date"])
+    present = marks["present"].astype(bool)
+
+    # Number each run of identical marks so streaks are just run lengths
+    run = (
+        (present != present.shift())
+        | (marks["participant"] != marks["participant"].shift())
+    ).cumsum()
+    run_lengths = marks.groupby(run)["date"].transform("size")
+    present_runs = run_lengths.where(present, 0)
+
+    grouped = marks.assign(
+        present=present, present_run=present_runs,
+        attended_on=marks["date"].where(present),
+    ).groupby("participant")
+
+    stats = pd.DataFrame({
+        "sessions": grouped.size(),
+        "present": grouped["present"].sum(),
+        "last_attended": grouped["attended_on"].last(),
+        "current_streak": grouped["present_run"].last(),
+        "longest_streak": grouped["present_run"].max(),
+    })
+    stats["absent"] = stats["sessions"] - stats["present"]
+    stats = stats.astype({
+        "sessions": int, "present": int, "absent": int,
+        "current_streak": int, "longest_streak": int,
+    })
+    stats["last_attended"] = stats["last_attended"].astype(object).where(
+        stats["last_attended"].notna(), None)
+    return stats
+
+
+def compute_rollup(training_id):
+    """Compute a training's rollup from scratch out of its attendance history."""
+    rollup = empty_rollup(training_id)
+    marks = pd.DataFrame(
+        repository.attendance_marks(training_id),
+        columns=["date", "topic", "participant_id", "present"]
+    )
+    if marks.empty:
+        return rollup
+
+    rollup["session_dates"] = sorted(marks["date"].unique().tolist())
+    rollup["sessions_held"] = len(rollup["session_dates"])
+    rollup["last_session"] = rollup["session_dates"][-1]
+
+    marks = marks.dropna(subset=["participant_id"])
+    if not marks.empty:
+        marks = marks.assign(participant=marks["participant_id"].astype(str))
+        rollup["participants"] = _participant_stats(marks).to_dict("index")
+    return rollup
+
+
+def rebuild(training_id=None, progress=None):
+    """Recompute the rollup for one training, or for every training if None.
+
+    Returns the rebuilt rollup for a single training, or the number of
+    trainings rebuilt. progress, if given, is called with the number of
+    trainings rebuilt so far when rebuilding all of them.
+
+    The rollup is only written if nobody else wrote it while it was being
+    computed; otherwise the stored one is left as it is (stale or pending
+    again) for the next read to rebuild, and the computed rollup is still
+    returned.
+    """
+    if training_id is None:
+        training_ids = repository.attendance_training_ids()
+        for done, training_id in enumerate(training_ids, 1):
+            rebuild(training_id)
+            if progress is not None:
+                progress(done)
+        repository.delete_rollups_except(training_ids)
+        return len(training_ids)
+
+    stored = repository.get_rollup(training_id)
+    version = stored["version"] if stored else 0
+    rollup = compute_rollup(training_id)
+    rollup["version"] = version + 1
+    repository.replace_rollup(rollup, version)
+    return rollup
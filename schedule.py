@@ -0,0 +1,57 @@
+"""Expected session dates from a training's start date, days and end date.
+
+Nothing is stored: the dates are generated on demand with one vectorised
+date_range, minus holidays, and memoised on exactly the values that decide
+them. Editing a training or the holiday list changes the inputs, so stale
+schedules are never served and nothing has to be invalidated.
+"""
+from datetime import datetime
+from functools import lru_cache
+
+import pandas as pd
+
+import repository
+import rollups
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday",
+            "Saturday", "Sunday"]
+
+# Distinct (training, period) schedules kept in memory
+SCHEDULE_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=SCHEDULE_CACHE_SIZE)
+def _scheduled_dates(start_date, stop_date, training_days, holidays):
+    """Tuple of "YYYY-MM-DD" dates on training_days from start to stop inclusive."""
+    if not start_date or not training_days or start_date > stop_date:
+        return ()
+    dates = pd.date_range(start_date, stop_date)
+    dates = dates[dates.day_name().isin(training_days)].strftime("%Y-%m-%d")
+    return tuple(dates[~dates.isin(holidays)])
+
+
+def expected_dates(training, since=None, until=None):
+    """Dates the training is scheduled to meet, oldest first.
+
+    Runs from the later of its start date and since up to the earlier of
+    its end date and until (today if None), skipping holidays.
+    """
+    until = until or datetime.today().strftime("%Y-%m-%d")
+    end_date = training.get("end_date")
+    stop_date = min(end_date, until) if end_date else until
+    start_date = training.get("start_date") or ""
+    if since and since > start_date:
+        start_date = since
+    return list(_scheduled_dates(
+        start_date, stop_date, tuple(training.get("training_days") or ()),
+        repository.holidays()))
+
+
+def unrecorded_dates(training, until=None):
+    """Scheduled dates up to until (today if None) with no saved session.
+
+    Recorded dates come from the training's rollup, so this costs no
+    attendance query.
+    """
+    recorded = set(rollups.current(training["_id"])["session_dates"])
+    return [date for date in expected_dates(training, until=until) if date not in recorded]
@@ -0,0 +1,57 @@
+"""Run every test against a fresh in-memory mongomock database."""
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+import mongomock.collection
+
+import db
+import repository
+
+TEST_DB_NAME = "training_test"
+
+
+@pytest.fixture(scope="session")
+def client():
+    # pymongo 4.11 passes a sort option to bulk updates that mongomock does
+    # not know about; it is never used by this app
+    builder = mongomock.collection.BulkOperationBuilder
+    with pytest.MonkeyPatch.context() as patch:
+        for method in ("add_update", "add_replace"):
+            original = getattr(builder, method)
+            patch.setattr(builder, method,
+                          lambda self, *args, sort=None, _original=original, **kwargs:
+                          _original(self, *args, **kwargs))
+        client = mongomock.MongoClient()
+        db.set_client(client)
+        yield client
+
+
+@pytest.fixture
+def database(client, monkeypatch):
+    monkeypatch.setattr(db, "MONGODB_DB_NAME", TEST_DB_NAME)
+    client.drop_database(TEST_DB_NAME)
+    repository.invalidate_cache()
+    yield client[TEST_DB_NAME]
+    repository.invalidate_cache()
+
+
+@pytest.fixture
+def make_training(database):
+    """Factory for a "Python" training with (name, email) participants enrolled.
+
+    Returns (training _id, participant _ids in the order given).
+    """
+    def make(participants=(("Ali", "ali@example.com"), ("Sara", "sara@example.com"))):
+        participant_ids = database.participants.insert_many([
+            repository.with_search_keys({"participant_name": name, "email": email, "phone": ""})
+            for name, email in participants
+        ]).inserted_ids
+        training_id = database.trainings.insert_one({
+            "training_name": "Python", "trainer_name": "Omar",
+            "start_date": "2025-01-06", "training_days": ["Monday"],
+            "participant_ids": participant_ids,
+        }).inserted_id
+        return training_id, participant_ids
+
+    return make
@@ -0,0 +1,20 @@
+"""Saving the attendance grid."""
+import attendance
+import repository
+
+
+def test_saving_the_grid_keeps_marks_of_removed_participants(make_training):
+    training_id, (ali, sara) = make_training()
+    attendance.save_sessions(training_id, [
+        {"date": "2025-01-06", "topic": "Intro", "attendance": {ali: True, sara: True}}])
+
+    # Sara was removed from the training, so the grid only has Ali
+    grid, topics = attendance.session_grid(training_id, [ali], ["2025-01-06", "2025-01-13"])
+    grid[:] = False
+    attendance.save_sessions(training_id, attendance.sessions_from_grid(
+        training_id, grid, {date: "Loops" for date in topics}))
+
+    assert repository.saved_attendance(training_id, ["2025-01-06", "2025-01-13"]) == {
+        "2025-01-06": ("Loops", {ali: False, sara: True}),
+        "2025-01-13": ("Loops", {ali: False}),
+    }
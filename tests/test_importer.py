@@ -0,0 +1,84 @@
+"""Status sheet imports diffed against saved attendance."""
+import io
+
+import pytest
+
+import attendance
+import importer
+import repository
+
+
+def sheet(text, name="status.csv"):
+    file = io.BytesIO(text.encode())
+    file.name = name
+    return file
+
+
+@pytest.fixture
+def training(make_training):
+    training_id, participant_ids = make_training((
+        ("Ali", "ali@example.com"), ("Sara", "sara@example.com"),
+        ("Sara", "sara.k@example.com")))
+    ali, sara, sara_k = participant_ids
+    attendance.save_sessions(training_id, [{
+        "date": "2025-01-06", "topic": "Intro",
+        "attendance": {ali: True, sara: False, sara_k: True},
+    }])
+    return training_id, participant_ids
+
+
+def test_only_new_and_changed_sessions_are_planned(training):
+    training_id, (ali, sara, sara_k) = training
+    plan = importer.plan_attendance_import(training_id, sheet(
+        'Participant Name,Email,"2025-01-06\n(Intro)","2025-01-13\n(Loops)"\n'
+        "Ali,,P,A\n"
+        "Sara,sara@example.com,P,\n"
+    ))
+
+    assert plan["errors"] == []
+    assert plan["summary"].to_dict("records") == [
+        {"Date": "2025-01-06", "Topic": "Intro", "Change": "updated", "Marks Changed": 1},
+        {"Date": "2025-01-13", "Topic": "Loops", "Change": "new", "Marks Changed": 1},
+    ]
+    first, second = plan["sessions"]
+    # Blank cells keep the saved mark
+    assert first["attendance"] == {ali: True, sara: True, sara_k: True}
+    assert second["attendance"] == {ali: False}
+
+
+def test_an_unchanged_sheet_plans_nothing(training):
+    training_id, _ = training
+    plan = importer.plan_attendance_import(training_id, sheet(
+        "Participant Name,Email,2025-01-06\n"
+        "Ali,,P\n"
+        "Sara,sara@example.com,A\n"
+    ))
+    assert plan["sessions"] == []
+    assert list(plan["summary"]["Change"]) == ["unchanged"]
+
+
+def test_problem_rows_are_reported_and_skipped(training):
+    training_id, _ = training
+    plan = importer.plan_attendance_import(training_id, sheet(
+        "Participant Name,Date,2025-01-13\n"
+        "Sara,x,P\n"
+        "Nobody,x,A\n"
+        "Ali,x,Y\n"
+    ))
+    assert [e["row"] for e in plan["errors"]] == [1, 2, 3, 4]
+    assert "not a date" in plan["errors"][0]["error"]
+    assert "more than one participant" in plan["errors"][1]["error"]
+    assert "no participant named Nobody" in plan["errors"][2]["error"]
+    assert "not P or A" in plan["errors"][3]["error"]
+    assert plan["sessions"] == []
+
+
+def test_applying_a_plan_saves_it(training):
+    training_id, (ali, _, _) = training
+    plan = importer.plan_attendance_import(training_id, sheet(
+        'Participant Name,Email,"2025-01-13\n(Loops)"\nAli,,P\n'))
+    importer.apply_attendance_import(training_id, plan["sessions"])
+
+    assert repository.saved_attendance(training_id, ["2025-01-13"]) == {
+        "2025-01-13": ("Loops", {ali: True})}
+    assert repository.get_rollup(training_id)["session_dates"] == ["2025-01-06", "2025-01-13"]
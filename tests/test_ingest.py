@@ -0,0 +1,98 @@
+"""Buffered check-ins: coalescing, retries and rollups."""
+import pytest
+
+import attendance
+import ingest
+import migrations
+import repository
+import rollups
+
+
+def checkin(email, present=True, date="2025-01-06"):
+    return {"training_name": "Python", "email": email, "date": date, "present": present}
+
+
+def test_a_failed_flush_keeps_its_marks_for_the_retry(make_training, monkeypatch):
+    training_id, (ali, sara) = make_training()
+    buffer = ingest.CheckinBuffer(max_pending=100)
+    buffer.add([checkin("ali@example.com"), checkin("sara@example.com")])
+
+    def fail(records, **kwargs):
+        raise ConnectionError("primary stepped down")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(rollups, "save_sessions", fail)
+        with pytest.raises(ConnectionError):
+            buffer.flush()
+    # A newer mark that arrived after the failed flush began wins
+    buffer.add([checkin("sara@example.com", present=False)])
+
+    assert buffer.flush() == 1
+    assert repository.saved_attendance(training_id, ["2025-01-06"]) == {
+        "2025-01-06": ("", {ali: True, sara: False})}
+    assert buffer.stats["failed_flushes"] == 1
+
+
+def test_resaving_a_session_defers_the_rollup_rebuild(make_training):
+    training_id, (ali, sara) = make_training()
+    rollups.current(training_id)
+    buffer = ingest.CheckinBuffer()
+    buffer.add([checkin("ali@example.com")])
+    buffer.flush()
+    assert not repository.get_rollup(training_id).get("stale")
+
+    buffer.add([checkin("sara@example.com")])
+    buffer.flush()
+    assert repository.get_rollup(training_id)["stale"] is True
+
+    participants = rollups.current(training_id)["participants"]
+    assert participants[str(sara)]["present"] == 1
+    assert participants[str(ali)]["present"] == 1
+
+
+@pytest.mark.parametrize("created_first", [False, True])
+def test_a_session_saved_during_a_flush_is_merged_not_overwritten(
+        make_training, monkeypatch, created_first):
+    training_id, (ali, sara) = make_training()
+    migrations.ensure_indexes()
+    if created_first:
+        attendance.save_sessions(training_id, [
+            {"date": "2025-01-06", "topic": "Intro", "attendance": {ali: False, sara: False}}])
+    buffer = ingest.CheckinBuffer()
+    buffer.add([checkin("ali@example.com")])
+    merge, merges = buffer._merge, []
+
+    def merge_then_save(pending):
+        merges.append(merge(pending))
+        if len(merges) == 1:
+            attendance.save_sessions(training_id, [
+                {"date": "2025-01-06", "topic": "Loops", "attendance": {sara: True}}])
+        return merges[-1]
+
+    monkeypatch.setattr(buffer, "_merge", merge_then_save)
+    assert buffer.flush() == 1
+    assert len(merges) == 2
+    assert repository.saved_attendance(training_id, ["2025-01-06"]) == {
+        "2025-01-06": ("Loops", {sara: True, ali: True})}
+
+
+def test_present_must_be_a_json_boolean(make_training):
+    make_training()
+    buffer = ingest.CheckinBuffer()
+    accepted, errors = buffer.add([checkin("ali@example.com", present="false"),
+                                   checkin("sara@example.com", present=False)])
+    assert accepted == 1
+    assert errors == [{"index": 0, "error": "present must be true or false"}]
+
+
+def test_stop_gives_up_after_its_retries(make_training, monkeypatch):
+    make_training()
+    buffer = ingest.CheckinBuffer(flush_seconds=0)
+    buffer.add([checkin("ali@example.com")])
+
+    def fail(records, **kwargs):
+        raise ConnectionError("no primary")
+
+    monkeypatch.setattr(rollups, "save_sessions", fail)
+    assert buffer.stop(attempts=3) is False
+    assert buffer.stats["failed_flushes"] == 3
@@ -0,0 +1,31 @@
+"""Background job status as seen by pages polling it."""
+from datetime import datetime, timedelta
+
+import jobs
+import repository
+
+
+def job(worker, heartbeat, status="running"):
+    return repository.create_job({
+        "kind": "export_attendance", "label": "Export", "owner": "admin",
+        "worker": worker, "status": status, "created_at": heartbeat,
+        "heartbeat": heartbeat, "started_at": heartbeat, "finished_at": None,
+        "progress": {"done": 0, "total": None}, "result": None, "error": None,
+    })
+
+
+def test_a_job_whose_heartbeat_stopped_is_interrupted_whatever_its_worker(database):
+    stale = datetime.now() - timedelta(seconds=jobs.JOB_STALE_SECONDS + 1)
+    # A restarted container can come back with the same hostname and pid
+    own_id = job(jobs.WORKER_ID, stale)
+    other_id = job("other:1", stale, status="queued")
+
+    assert jobs.get(own_id)["status"] == "interrupted"
+    assert jobs.get(other_id)["status"] == "interrupted"
+
+
+def test_a_job_with_a_fresh_heartbeat_keeps_running(database):
+    job_id = job(jobs.WORKER_ID, datetime.now())
+    assert jobs.get(job_id)["status"] == "running"
+    assert jobs.recent()[0]["status"] == "running"
+
@@ -0,0 +1,178 @@
+"""Migrations against data in the shape the original app stored it."""
+import pytest
+
+import migrations
+import repository
+import rollups
+
+
+@pytest.fixture
+def legacy(database):
+    """Name-keyed trainings, attendance and removals as saved before migrations."""
+    database.participants.insert_many([
+        {"participant_name": "Ali", "email": "Ali@Example.com ", "phone": "1"},
+        {"participant_name": "Sara", "email": "sara@example.com", "phone": "2"},
+    ])
+    database.trainings.insert_one({
+        "training_name": "Python", "trainer_name": "Omar",
+        "start_date": "2025-01-06", "training_days": ["Monday", "Wednesday"],
+        "participants": ["Ali", "Sara", "Ghost"],
+    })
+    database.attendance.insert_many([
+        {"training_name": "Python", "date": "2025-01-06", "topic": "Intro",
+         "attendance": {"Ali": True, "Sara": False}},
+        # Saved twice for the same day; the later save wins
+        {"training_name": "Python", "date": "2025-01-06", "topic": "Intro again",
+         "attendance": {"Sara": True}},
+        {"training_name": "Python", "date": "2025-01-08", "topic": "Loops",
+         "attendance": {"Ali": False, "Sara": True, "Ghost": True}},
+        # The training was deleted but its history was kept
+        {"training_name": "Old Course", "date": "2024-12-02", "topic": "Setup",
+         "attendance": {"Ali": True}},
+    ])
+    database.removals.insert_many([
+        {"training_name": "Python", "participant_name": "Sara",
+         "reason": "moved", "removed_on": "2025-01-09 10:00:00"},
+        {"training_name": "Old Course", "participant_name": "Zed",
+         "reason": "left", "removed_on": "2024-12-03 10:00:00"},
+    ])
+    migrations.migrate(database)
+    return database
+
+
+def ids_by_name(database):
+    return {p["participant_name"]: p["_id"] for p in database.participants.find()}
+
+
+def test_all_migrations_are_recorded_and_indexes_built(legacy):
+    assert migrations.applied_versions(legacy) == {v for v, _, _ in migrations.MIGRATIONS}
+    assert migrations.pending_migrations(legacy) == []
+    assert migrations.missing_indexes(legacy) == []
+
+
+def test_training_references_participants_by_id(legacy):
+    ids = ids_by_name(legacy)
+    python = legacy.trainings.find_one({"training_name": "Python"})
+    assert "participants" not in python
+    assert python["participant_ids"] == [ids["Ali"], ids["Sara"], ids["Ghost"]]
+
+
+def test_unknown_names_get_placeholders(legacy):
+    ids = ids_by_name(legacy)
+    ghost = legacy.participants.find_one({"_id": ids["Ghost"]})
+    assert ghost["email"] == ""
+    assert ghost["search_keys"] == ["ghost"]
+    assert "Zed" in ids
+
+    old_course = legacy.trainings.find_one({"training_name": "Old Course"})
+    assert old_course["participant_ids"] == []
+    assert legacy.attendance.count_documents({"training_id": old_course["_id"]}) == 1
+
+
+def test_duplicate_saves_are_merged(legacy):
+    ids = ids_by_name(legacy)
+    python_id = legacy.trainings.find_one({"training_name": "Python"})["_id"]
+    records = list(legacy.attendance.find({"training_id": python_id}).sort("date", 1))
+
+    assert [r["date"] for r in records] == ["2025-01-06", "2025-01-08"]
+    first = records[0]
+    assert first["topic"] == "Intro again"
+    assert dict(zip(first["participant_ids"], first["present"])) == {
+        ids["Ali"]: True, ids["Sara"]: True}
+    for record in records:
+        assert "training_name" not in record and "attendance" not in record
+
+
+def test_removals_reference_ids(legacy):
+    ids = ids_by_name(legacy)
+    python_id = legacy.trainings.find_one({"training_name": "Python"})["_id"]
+    removal = legacy.removals.find_one({"reason": "moved"})
+    assert removal["training_id"] == python_id
+    assert removal["participant_id"] == ids["Sara"]
+    assert "training_name" not in removal and "participant_name" not in removal
+
+
+def test_rollups_are_rebuilt_under_ids(legacy):
+    ids = ids_by_name(legacy)
+    python_id = legacy.trainings.find_one({"training_name": "Python"})["_id"]
+    rollup = legacy.attendance_rollups.find_one({"_id": python_id})
+
+    assert rollup["session_dates"] == ["2025-01-06", "2025-01-08"]
+    assert rollup["sessions_held"] == 2
+    ali = rollup["participants"][str(ids["Ali"])]
+    assert (ali["present"], ali["absent"], ali["current_streak"], ali["longest_streak"]) \
+        == (1, 1, 0, 1)
+    assert ali["last_attended"] == "2025-01-06"
+    sara = rollup["participants"][str(ids["Sara"])]
+    assert (sara["present"], sara["current_streak"], sara["last_attended"]) \
+        == (2, 2, "2025-01-08")
+    assert legacy.attendance_rollups.count_documents({}) == 2
+    assert rollup == dict(rollups.compute_rollup(python_id), version=rollup["version"])
+
+
+def test_emails_and_sort_keys_are_normalised(legacy):
+    ali = legacy.participants.find_one({"participant_name": "Ali"})
+    assert ali["email"] == "ali@example.com"
+    assert ali["participant_name_lower"] == "ali"
+    python = legacy.trainings.find_one({"training_name": "Python"})
+    assert python["training_name_lower"] == "python"
+    assert python["trainer_name_lower"] == "omar"
+
+
+def test_blank_legacy_cells_do_not_stop_migrations(database):
+    # Old spreadsheet uploads stored empty cells as NaN
+    database.participants.insert_many([
+        {"participant_name": float("nan"), "email": "nan@example.com", "phone": "1"},
+        {"participant_name": "Nadia", "email": float("nan"), "phone": "2"},
+    ])
+    migrations.migrate(database)
+
+    assert migrations.pending_migrations(database) == []
+    nameless = database.participants.find_one({"email": "nan@example.com"})
+    assert nameless["search_keys"] == ["nan@example.com"]
+    assert nameless["participant_name_lower"] == ""
+    nadia = database.participants.find_one({"participant_name": "Nadia"})
+    assert nadia["search_keys"] == ["nadia"]
+    assert [p["_id"] for p in repository.search_participants("nad")] == [nadia["_id"]]
+
+
+def test_the_single_field_email_index_is_dropped(database):
+    database.participants.create_index("email", name="email")
+    migrations.migrate(database)
+    assert "email" not in database.participants.index_information()
+    assert "email_id" in database.participants.index_information()
+
+
+def test_migrate_is_idempotent(legacy):
+    before = {name: list(legacy[name].find()) for name in
+              ("trainings", "participants", "attendance", "removals")}
+    assert migrations.migrate(legacy) == []
+    assert {name: list(legacy[name].find()) for name in before} == before
+
+
+def test_duplicate_usernames_do_not_block_other_indexes(database):
+    database.users.insert_many([{"username": "admin"}, {"username": "admin"}])
+    with pytest.raises(migrations.IndexBuildError):
+        migrations.migrate(database)
+    assert migrations.missing_indexes(database) == [("users", "username_unique")]
+    assert migrations.unique_conflicts(database) == [
+        ("users", "username_unique", ["admin"])]
+
+
+def test_bootstrap_serves_despite_an_index_but_not_a_failed_migration(database, monkeypatch):
+    monkeypatch.setattr(migrations, "AUTO_MIGRATE", True)
+    monkeypatch.setattr(migrations, "_bootstrapped", False)
+    database.users.insert_many([{"username": "admin"}, {"username": "admin"}])
+    migrations.bootstrap()
+    assert migrations._bootstrapped
+
+    def broken(database):
+        raise ValueError("bad legacy document")
+
+    monkeypatch.setattr(migrations, "_bootstrapped", False)
+    monkeypatch.setattr(migrations, "MIGRATIONS",
+                        migrations.MIGRATIONS + [(99, "broken", broken)])
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            migrations.bootstrap()
+        assert not migrations._bootstrapped
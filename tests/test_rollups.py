@@ -0,0 +1,112 @@
+"""Rollup totals and streaks, kept in place and rebuilt from history."""
+import pytest
+from bson import ObjectId
+
+import attendance
+import repository
+import rollups
+
+
+def save(training_id, date, marks):
+    attendance.save_sessions(training_id, [{"date": date, "topic": "t", "attendance": marks}])
+
+
+def stats(training_id, participant_id):
+    return repository.get_rollup(training_id)["participants"][str(participant_id)]
+
+
+def test_streaks_follow_runs_of_presents(make_training):
+    training_id, (ali, sara) = make_training()
+    for date, present in [("2025-01-06", True), ("2025-01-13", True),
+                          ("2025-01-20", False), ("2025-01-27", True),
+                          ("2025-02-03", True), ("2025-02-10", True)]:
+        save(training_id, date, {ali: present, sara: not present})
+
+    assert stats(training_id, ali) == {
+        "sessions": 6, "present": 5, "absent": 1, "last_attended": "2025-02-10",
+        "current_streak": 3, "longest_streak": 3,
+    }
+    assert stats(training_id, sara) == {
+        "sessions": 6, "present": 1, "absent": 5, "last_attended": "2025-01-20",
+        "current_streak": 0, "longest_streak": 1,
+    }
+
+
+def test_later_sessions_update_in_place_and_match_a_rebuild(make_training):
+    training_id, (ali, sara) = make_training()
+    save(training_id, "2025-01-06", {ali: True, sara: False})
+    version = repository.get_rollup(training_id)["version"]
+    save(training_id, "2025-01-13", {ali: True, sara: True})
+
+    rollup = repository.get_rollup(training_id)
+    assert rollup["version"] == version + 2
+    assert rollup["pending"] == [] and "stale" not in rollup
+    assert rollup == dict(rollups.compute_rollup(training_id),
+                          version=rollup["version"], pending=[])
+
+
+def test_corrections_and_back_dated_saves_rebuild(make_training):
+    training_id, (ali, sara) = make_training()
+    save(training_id, "2025-01-13", {ali: True, sara: True})
+    save(training_id, "2025-01-06", {ali: False, sara: True})
+    save(training_id, "2025-01-13", {ali: False, sara: True})
+
+    assert repository.get_rollup(training_id)["session_dates"] == ["2025-01-06", "2025-01-13"]
+    assert stats(training_id, ali)["present"] == 0
+    assert stats(training_id, sara)["longest_streak"] == 2
+
+
+def test_deferred_rebuild_happens_on_read(make_training):
+    training_id, (ali, sara) = make_training()
+    save(training_id, "2025-01-06", {ali: True, sara: True})
+    rollups.save_sessions(
+        [attendance.compact_record(training_id, "2025-01-06", "t", {ali: False, sara: True})],
+        rebuild_stale=False)
+
+    assert repository.get_rollup(training_id)["stale"] is True
+    assert rollups.current(training_id)["participants"][str(ali)]["present"] == 0
+    assert "stale" not in repository.get_rollup(training_id)
+
+
+def test_a_write_interrupted_before_the_rollup_is_rebuilt_on_read(make_training, monkeypatch):
+    training_id, (ali, sara) = make_training()
+    save(training_id, "2025-01-06", {ali: True, sara: True})
+
+    def fail(*args, **kwargs):
+        raise ConnectionError("primary stepped down")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(rollups, "_fold_sessions", fail)
+        with pytest.raises(ConnectionError):
+            save(training_id, "2025-01-13", {ali: True, sara: False})
+
+    assert repository.get_rollup(training_id)["pending"]
+    rollup = rollups.current(training_id)
+    assert rollup["sessions_held"] == 2
+    assert rollup["participants"][str(sara)]["current_streak"] == 0
+
+
+def test_marks_for_unknown_participants_still_count(make_training):
+    training_id, (ali, _) = make_training()
+    stranger = ObjectId()
+    save(training_id, "2025-01-06", {ali: True, stranger: True})
+    assert stats(training_id, stranger)["present"] == 1
+
+
+def test_a_save_during_a_rebuild_is_not_overwritten(make_training, monkeypatch):
+    training_id, (ali, sara) = make_training()
+    save(training_id, "2025-01-06", {ali: True, sara: True})
+    compute_rollup = rollups.compute_rollup
+
+    def compute_then_save(training_id):
+        rollup = compute_rollup(training_id)
+        rollups.save_sessions([attendance.compact_record(
+            training_id, "2025-01-06", "t", {ali: False, sara: True})], rebuild_stale=False)
+        return rollup
+
+    with monkeypatch.context() as patch:
+        patch.setattr(rollups, "compute_rollup", compute_then_save)
+        assert rollups.rebuild(training_id)["participants"][str(ali)]["present"] == 1
+
+    assert repository.get_rollup(training_id)["stale"] is True
+    assert rollups.current(training_id)["participants"][str(ali)]["present"] == 0